@@ -15,6 +15,9 @@ create table subscriptions (
     stripe_customer_id text unique,
     status text not null,
     followupboss_api_key text,
+    market text,  -- gazetteer market (config/gazetteers/<market>.csv); null uses CITY_GAZETTEER_MARKET
+    leads_cursor_created_at timestamp with time zone,
+    leads_cursor_person_id bigint,
     created_at timestamp with time zone default timezone('utc'::text, now()) not null,
     updated_at timestamp with time zone default timezone('utc'::text, now()) not null
 );
@@ -25,10 +28,47 @@ create table script_executions (
     subscription_id bigint references subscriptions(id) not null,
     status text not null,
     leads_processed integer default 0,
+    leads_skipped integer default 0,
     cities_tagged integer default 0,
+    tag_writes_failed integer default 0,
     error_message text,
     created_at timestamp with time zone default timezone('utc'::text, now()) not null,
-    completed_at timestamp with time zone
+    completed_at timestamp with time zone,
+    change_seq bigint  -- set by the database on every insert and update; history polling follows it
+);
+
+-- Leads tagged per city in each execution
+create table execution_city_counts (
+    id bigint primary key generated always as identity,
+    execution_id bigint references script_executions(id) on delete cascade not null,
+    subscription_id bigint references subscriptions(id) not null,
+    city text not null,
+    leads_tagged integer not null,
+    created_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+-- Execution totals per subscription, bucketed by hour and by day
+create table execution_rollups (
+    subscription_id bigint references subscriptions(id) not null,
+    period text not null check (period in ('hour', 'day')),
+    bucket_start timestamp with time zone not null,
+    executions integer default 0 not null,
+    failed_executions integer default 0 not null,
+    leads_processed integer default 0 not null,
+    leads_skipped integer default 0 not null,
+    cities_tagged integer default 0 not null,
+    updated_at timestamp with time zone default timezone('utc'::text, now()) not null,
+    primary key (subscription_id, period, bucket_start)
+);
+
+-- Leads tagged per subscription and city, bucketed by hour and by day
+create table execution_city_rollups (
+    subscription_id bigint references subscriptions(id) not null,
+    period text not null check (period in ('hour', 'day')),
+    bucket_start timestamp with time zone not null,
+    city text not null,
+    leads_tagged integer default 0 not null,
+    primary key (subscription_id, period, bucket_start, city)
 );
 
 -- Add indexes
@@ -37,6 +77,9 @@ create index idx_subscriptions_user_id on subscriptions(user_id);
 create index idx_subscriptions_status on subscriptions(status);
 create index idx_script_executions_subscription_id on script_executions(subscription_id);
 create index idx_script_executions_created_at on script_executions(created_at);
+create index idx_script_executions_subscription_change_seq on script_executions(subscription_id, change_seq);
+create index idx_execution_city_counts_execution_id on execution_city_counts(execution_id);
+create index idx_execution_city_counts_subscription_created on execution_city_counts(subscription_id, created_at);
 
 -- Add updated_at trigger function
 create or replace function handle_updated_at()
@@ -56,4 +99,78 @@ create trigger users_updated_at
 create trigger subscriptions_updated_at
     before update on subscriptions
     for each row
-    execute function handle_updated_at(); 
\ No newline at end of file
+    execute function handle_updated_at(); 
+
+-- Number every change to an execution in order. created_at comes from the
+-- client and rows are inserted in batches, so it can't tell pollers what's new
+create sequence script_executions_change_seq;
+
+create or replace function handle_execution_change()
+returns trigger as $$
+begin
+    new.change_seq = nextval('script_executions_change_seq');
+    return new;
+end;
+$$ language plpgsql;
+
+create trigger script_executions_change_seq
+    before insert or update on script_executions
+    for each row
+    execute function handle_execution_change();
+
+-- Add finished executions to the rollups. p_rows is a JSON array of
+-- {subscription_id, completed_at, status, leads_processed, leads_skipped,
+-- cities_tagged, city_counts: {city: leads}}; each row increments its hour
+-- and day buckets.
+create or replace function increment_execution_rollups(p_rows jsonb)
+returns void as $$
+declare
+    r jsonb;
+    p text;
+    bucket timestamp with time zone;
+    c record;
+begin
+    for r in select * from jsonb_array_elements(p_rows) loop
+        foreach p in array array['hour', 'day'] loop
+            bucket := date_trunc(p, coalesce((r->>'completed_at')::timestamptz, now()) at time zone 'utc') at time zone 'utc';
+
+            insert into execution_rollups as er (
+                subscription_id, period, bucket_start, executions, failed_executions,
+                leads_processed, leads_skipped, cities_tagged
+            ) values (
+                (r->>'subscription_id')::bigint, p, bucket, 1,
+                case when r->>'status' = 'failed' then 1 else 0 end,
+                coalesce((r->>'leads_processed')::int, 0),
+                coalesce((r->>'leads_skipped')::int, 0),
+                coalesce((r->>'cities_tagged')::int, 0)
+            )
+            on conflict (subscription_id, period, bucket_start) do update set
+                executions = er.executions + excluded.executions,
+                failed_executions = er.failed_executions + excluded.failed_executions,
+                leads_processed = er.leads_processed + excluded.leads_processed,
+                leads_skipped = er.leads_skipped + excluded.leads_skipped,
+                cities_tagged = er.cities_tagged + excluded.cities_tagged,
+                updated_at = timezone('utc'::text, now());
+
+            for c in select key as city, value::int as leads from jsonb_each_text(coalesce(r->'city_counts', '{}'::jsonb)) loop
+                insert into execution_city_rollups as ecr (subscription_id, period, bucket_start, city, leads_tagged)
+                values ((r->>'subscription_id')::bigint, p, bucket, c.city, c.leads)
+                on conflict (subscription_id, period, bucket_start, city) do update set
+                    leads_tagged = ecr.leads_tagged + excluded.leads_tagged;
+            end loop;
+        end loop;
+    end loop;
+end;
+$$ language plpgsql;
+
+-- Leads tagged per city for a subscription between two times
+create or replace function city_counts_between(p_subscription_id bigint, p_start timestamptz, p_end timestamptz)
+returns table (city text, leads_tagged bigint) as $$
+    select city, sum(leads_tagged)::bigint
+    from execution_city_counts
+    where subscription_id = p_subscription_id
+      and created_at >= p_start
+      and created_at < p_end
+    group by city
+    order by 2 desc, 1;
+$$ language sql stable;
@@ -5,8 +5,11 @@ import os
 import stripe
 from flask_mail import Mail, Message
 from flask_login import LoginManager, login_user, login_required, current_user, logout_user
-from src.models.database import Database, User
+from src.models.database import Database, User, subscription_cache
 from src.services.city_tagger_service import city_tagger_service
+from src.services.response_cache import response_cache
+from src.services.webhook_dedup import webhook_deduplicator, event_key, lead_key
+from src.services.zillow_lead_tagger import lead_flights
 from dotenv import load_dotenv
 import bcrypt
 import base64
@@ -82,12 +85,24 @@ def dashboard():
         return redirect(url_for('subscribe_city_tagger'))
     
     # Get recent execution history (limited to 5 entries)
-    executions_data = Database.get_subscription_executions(subscription['id'])
+    executions_data = Database.get_subscription_executions(subscription['id'], limit=5)
     executions = executions_data.data if executions_data.data else []
     
     return render_template('dashboard.html', 
                           subscription=subscription,
-                          executions=executions)
+                          executions=executions,
+                          summary=get_execution_summary(subscription['id']))
+
+# Execution history rows per page on the dashboard
+EXECUTIONS_PAGE_SIZE = 50
+
+def get_execution_summary(subscription_id):
+    """Last 30 days of totals from the rollup tables, or None if they can't be read"""
+    try:
+        return Database.get_rollup_summary(subscription_id, days=30)
+    except Exception as e:
+        app.logger.error(f"Error loading execution rollups: {str(e)}")
+        return None
 
 @app.route('/scripts/city-tagger')
 @login_required
@@ -105,13 +120,76 @@ def city_tagger_dashboard():
         flash('Please set your Follow Up Boss API key to use City Tagger', 'warning')
         return redirect(url_for('settings'))
     
-    # Get execution history specific to this script
-    executions_data = Database.get_subscription_executions(subscription['id'])
+    # Get the first page of execution history; the page polls for new and changed runs.
+    # The latest change is read first so a change made in between is fetched again, not missed
+    latest_change = Database.get_latest_execution_change(subscription['id'])
+    executions_data = Database.get_subscription_executions(subscription['id'], limit=EXECUTIONS_PAGE_SIZE)
     executions = executions_data.data if executions_data.data else []
     
     return render_template('city_tagger_dashboard.html', 
                           subscription=subscription,
-                          executions=executions)
+                          executions=executions,
+                          latest_change=latest_change,
+                          next_cursor=get_next_cursor(executions, EXECUTIONS_PAGE_SIZE),
+                          summary=get_execution_summary(subscription['id']))
+
+def get_next_cursor(executions, limit):
+    """Cursor for the page after this one, or None on the last page"""
+    if len(executions) < limit:
+        return None
+    return Database.encode_execution_cursor(Database.execution_cursor(executions[-1]))
+
+@app.route('/scripts/city-tagger/executions')
+@login_required
+def city_tagger_executions():
+    """Execution history as JSON: rows added or changed after ?since= (a change_seq),
+    or the page older than ?before=
+
+    Also accepts status (comma separated), start and end (ISO dates) and limit.
+    """
+    subscription_data = Database.get_user_subscription(current_user.id)
+    subscription = subscription_data.data[0] if subscription_data.data else None
+    if not subscription:
+        return jsonify({'error': 'No active subscription found'}), 404
+    
+    since = request.args.get('since')
+    before = Database.decode_execution_cursor(request.args.get('before'))
+    if (since and not since.isdigit()) or (request.args.get('before') and not before):
+        return jsonify({'error': 'Invalid cursor'}), 400
+    since = int(since) if since else None
+    if since is not None and before:
+        return jsonify({'error': 'Use either since or before'}), 400
+    
+    try:
+        limit = min(max(int(request.args.get('limit', EXECUTIONS_PAGE_SIZE)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    status = [s for s in request.args.get('status', '').split(',') if s] or None
+    
+    # Read the latest change before the rows, so a change made in between is fetched again, not missed
+    latest_change = Database.get_latest_execution_change(subscription['id']) if since is None and not before else None
+    executions_data = Database.get_subscription_executions(
+        subscription['id'],
+        limit=limit,
+        before=before,
+        since=since,
+        status=status,
+        start=request.args.get('start'),
+        end=request.args.get('end')
+    )
+    executions = executions_data.data or []
+    
+    if since is not None:
+        latest_change = Database.latest_change_seq(executions, since)
+    return jsonify({
+        'executions': executions,
+        'count': len(executions),
+        'html': render_template('_execution_rows.html', executions=executions),
+        'latest_change': latest_change,
+        # A full page of changes means more are waiting for the next poll
+        'more_changes': since is not None and len(executions) == limit,
+        'next_cursor': None if since is not None else get_next_cursor(executions, limit)
+    }), 200
 
 @app.route('/settings', methods=['GET'])
 @login_required
@@ -150,7 +228,7 @@ def update_api_key():
                 flash('Warning: Failed to set up webhook. Please contact support.', 'warning')
             
             # Then process historical leads
-            tagged_count = process_all_leads(api_key, subscription['id'])
+            tagged_count = process_all_leads(api_key, subscription['id'], market=subscription.get('market'))
             flash(f'Successfully processed {tagged_count} historical leads', 'success')
             
             # Redirect to dashboard to show execution results
@@ -179,9 +257,13 @@ def process_leads():
         flash('Please set your Follow Up Boss API key first', 'error')
         return redirect(url_for('settings'))
     
+    # Only fetch leads created since the last run unless a full re-scan is requested
+    full_rescan = request.form.get('full_rescan') == 'on'
+    
     try:
         from src.services.zillow_lead_tagger import process_all_leads
-        tagged_count = process_all_leads(api_key, subscription['id'])
+        tagged_count = process_all_leads(api_key, subscription['id'], incremental=not full_rescan,
+                                         market=subscription.get('market'))
         flash(f'Successfully processed {tagged_count} leads', 'success')
         return redirect(url_for('city_tagger_dashboard'))
     except Exception as e:
@@ -236,6 +318,11 @@ def followupboss_webhook():
         
         if event_type != 'peopleCreated':
             return jsonify({'status': 'ignored'}), 200
+        
+        # Retried deliveries are answered before any Supabase or Follow Up Boss calls
+        if event_id and webhook_deduplicator.seen(event_key(event_id)):
+            app.logger.info(f"Duplicate webhook event {event_id} - skipping")
+            return jsonify({'status': 'duplicate', 'eventId': event_id}), 200
             
         # Check authentication
         subscription_id = None
@@ -249,7 +336,7 @@ def followupboss_webhook():
                 auth_decoded = base64.b64decode(auth_header.split(' ')[1]).decode('ascii')
                 api_key = auth_decoded.split(':')[0]  # Format is "api_key:"
                 
-                subscription = Database.get_subscription_by_api_key(api_key).data[0] if Database.get_subscription_by_api_key(api_key).data else None
+                subscription = Database.get_cached_subscription_by_api_key(api_key)
                 if not subscription:
                     return jsonify({'error': 'Invalid API key'}), 401
                 subscription_id = subscription.get('id')
@@ -258,33 +345,58 @@ def followupboss_webhook():
                 app.logger.error(f"Authentication error: {str(e)}")
                 return jsonify({'error': 'Invalid authentication format'}), 401
         
-        # Process each lead in the resourceIds
-        success_count = 0
-        for lead_id in resource_ids:
-            try:
-                api_key = os.getenv('FOLLOWUPBOSS_API_KEY')
-                if not api_key:
-                    return jsonify({'error': 'Follow Up Boss API key not configured'}), 500
-                    
-                # Process lead in test mode or with valid subscription
-                if app.config.get('TESTING') or subscription_id:
-                    app.logger.info(f"Processing lead {lead_id}")
-                    if city_tagger_service.process_new_lead(lead_id, api_key):
-                        success_count += 1
-                        
-            except Exception as e:
-                app.logger.error(f"Error processing lead {lead_id}: {str(e)}")
-                continue
+        # Queue each lead in the resourceIds; workers tag them after we respond
+        api_key_env = 'FOLLOWUPBOSS_API_KEY'
+        if not os.getenv(api_key_env):
+            return jsonify({'error': 'Follow Up Boss API key not configured'}), 500
         
-        if success_count > 0:
-            return jsonify({'status': 'success', 'leads_processed': len(resource_ids), 'leads_tagged': success_count}), 200
-        else:
-            return jsonify({'error': 'Failed to process leads - no cities found'}), 500
+        queued_count = 0
+        duplicate_count = 0
+        # Process lead in test mode or with valid subscription
+        if app.config.get('TESTING') or subscription_id:
+            for lead_id in resource_ids:
+                # The same lead can arrive under a different eventId
+                key = lead_key(subscription_id, lead_id)
+                if webhook_deduplicator.check_and_mark(key):
+                    app.logger.info(f"Lead {lead_id} already queued - skipping")
+                    duplicate_count += 1
+                    continue
+                
+                app.logger.info(f"Queueing lead {lead_id}")
+                try:
+                    city_tagger_service.enqueue_lead(lead_id, api_key_env, subscription_id)
+                except Exception:
+                    # Let Follow Up Boss's retry queue it
+                    webhook_deduplicator.forget(key)
+                    raise
+                queued_count += 1
+            
+            # Only remember the event once its leads are safely queued
+            if event_id:
+                webhook_deduplicator.check_and_mark(event_key(event_id))
+        
+        return jsonify({
+            'status': 'queued',
+            'leads_received': len(resource_ids),
+            'leads_queued': queued_count,
+            'leads_duplicate': duplicate_count
+        }), 202
             
     except Exception as e:
         app.logger.error(f"Error processing webhook: {str(e)}")
         return jsonify({'error': f'Failed to process leads: {str(e)}'}), 500
 
+@app.route('/webhook/followupboss/queue', methods=['GET'])
+@login_required
+def followupboss_webhook_queue():
+    """Webhook job queue depth, wait time and processing time, plus cache and de-duplication counters"""
+    stats = city_tagger_service.queue_stats()
+    stats['response_cache'] = response_cache.stats()
+    stats['deduplication'] = webhook_deduplicator.stats()
+    stats['lead_runs'] = lead_flights.stats()
+    stats['subscription_cache'] = subscription_cache.stats()
+    return jsonify(stats), 200
+
 @app.route('/subscribe/city-tagger', methods=['GET'])
 def subscribe_city_tagger_page():
     """Redirect to e8solutions.io subscription page"""
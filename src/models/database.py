@@ -1,5 +1,9 @@
 from supabase import create_client
 import os
+from datetime import datetime, timedelta, timezone
+import time
+import hashlib
+import threading
 from dotenv import load_dotenv
 from flask_login import UserMixin
 
@@ -14,6 +18,72 @@ if not supabase_url or not supabase_key:
 
 supabase = create_client(supabase_url, supabase_key)
 
+# Seconds a subscription looked up by API key is reused, and how long an unknown key stays unknown
+SUBSCRIPTION_CACHE_TTL = float(os.getenv('SUBSCRIPTION_CACHE_TTL', 300))
+SUBSCRIPTION_NEGATIVE_TTL = float(os.getenv('SUBSCRIPTION_NEGATIVE_TTL', 60))
+
+class SubscriptionCache:
+    """Subscriptions by Follow Up Boss API key, keyed by the key's SHA-256"""
+
+    def __init__(self, ttl=SUBSCRIPTION_CACHE_TTL, negative_ttl=SUBSCRIPTION_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = {}  # key hash -> (expires_at, subscription or None)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(api_key):
+        return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()
+
+    def get(self, api_key):
+        """Return (found, subscription); subscription is None for a cached unknown key"""
+        key = self.key(api_key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return False, None
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[1]
+
+    def set(self, api_key, subscription):
+        ttl = self.ttl if subscription is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[self.key(api_key)] = (time.monotonic() + ttl, subscription)
+
+    def invalidate_api_key(self, api_key):
+        with self.lock:
+            self.entries.pop(self.key(api_key), None)
+
+    def invalidate_where(self, field, value):
+        """Drop cached subscriptions whose field matches value"""
+        with self.lock:
+            for key, (expires_at, subscription) in list(self.entries.items()):
+                if subscription is not None and subscription.get(field) == value:
+                    del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0
+            }
+
+subscription_cache = SubscriptionCache()
+
 class User(UserMixin):
     def __init__(self, user_data):
         self.id = user_data['id']
@@ -78,9 +148,11 @@ class Database:
 
     @staticmethod
     def update_subscription_status(stripe_subscription_id, status):
-        return supabase.table('subscriptions').update({
+        result = supabase.table('subscriptions').update({
             'status': status
         }).eq('stripe_subscription_id', stripe_subscription_id).execute()
+        subscription_cache.invalidate_where('stripe_subscription_id', stripe_subscription_id)
+        return result
 
     @staticmethod
     def get_user_subscription(user_id):
@@ -94,22 +166,178 @@ class Database:
         }).execute()
 
     @staticmethod
-    def update_script_execution(execution_id, status, leads_processed=None, cities_tagged=None, error_message=None, tagged_cities=None):
+    def create_script_executions(rows):
+        """Insert finished execution rows in one request"""
+        return supabase.table('script_executions').insert(rows).execute()
+
+    @staticmethod
+    def update_script_execution(execution_id, status, leads_processed=None, cities_tagged=None, error_message=None, tagged_cities=None, leads_skipped=None,
+                                tag_writes_failed=None):
         update_data = {'status': status}
         if leads_processed is not None:
             update_data['leads_processed'] = leads_processed
+        if leads_skipped is not None:
+            update_data['leads_skipped'] = leads_skipped
         if cities_tagged is not None:
             update_data['cities_tagged'] = cities_tagged
         if error_message is not None:
             update_data['error_message'] = error_message
         if tagged_cities is not None:
             update_data['tagged_cities'] = tagged_cities
+        if tag_writes_failed is not None:
+            update_data['tag_writes_failed'] = tag_writes_failed
         
         return supabase.table('script_executions').update(update_data).eq('id', execution_id).execute()
 
     @staticmethod
-    def get_subscription_executions(subscription_id):
-        return supabase.table('script_executions').select('*').eq('subscription_id', subscription_id).order('created_at', desc=True).limit(50).execute()
+    def get_subscription_executions(subscription_id, limit=50, before=None, since=None, status=None, start=None, end=None):
+        """Executions newest first, keyset-paginated on (created_at, id)
+
+        before is the cursor of the last row already shown and returns the
+        next, older page. since is the highest change_seq already seen and
+        instead returns the rows inserted or updated after it, newest change
+        first, so polling from the highest change_seq returned picks up new
+        runs and status changes. change_seq is assigned by the database, so
+        a row inserted late with an older created_at is still picked up.
+        status is a status or list of statuses; start and end bound
+        created_at.
+        """
+        if before and since is not None:
+            raise ValueError("Use either before or since, not both")
+
+        query = supabase.table('script_executions').select('*').eq('subscription_id', subscription_id)
+        if status:
+            if isinstance(status, (list, tuple)):
+                query = query.in_('status', list(status))
+            else:
+                query = query.eq('status', status)
+        if start:
+            query = query.gte('created_at', start)
+        if end:
+            query = query.lt('created_at', end)
+
+        if since is not None:
+            # Take the oldest changes first so a busy interval can't skip any,
+            # then hand them back newest first like every other page
+            result = query.gt('change_seq', int(since)).order('change_seq').limit(limit).execute()
+            result.data = list(reversed(result.data or []))
+            return result
+
+        # Rows sharing a timestamp are ordered by id, so no row is skipped or repeated
+        if before:
+            query = query.or_(f'created_at.lt."{before["created_at"]}",'
+                              f'and(created_at.eq."{before["created_at"]}",id.lt.{int(before["id"])})')
+        return query.order('created_at', desc=True).order('id', desc=True).limit(limit).execute()
+
+    @staticmethod
+    def get_latest_execution_change(subscription_id):
+        """Highest change_seq among a subscription's executions, or 0"""
+        query = supabase.table('script_executions').select('change_seq').eq('subscription_id', subscription_id)
+        result = query.gt('change_seq', 0).order('change_seq', desc=True).limit(1).execute()
+        return result.data[0]['change_seq'] if result.data else 0
+
+    @staticmethod
+    def latest_change_seq(executions, since=0):
+        """Highest change_seq among rows, or since if none is higher"""
+        return max([since or 0] + [execution.get('change_seq') or 0 for execution in executions])
+
+    @staticmethod
+    def execution_cursor(execution):
+        """Keyset cursor for an execution row, or None"""
+        if not execution:
+            return None
+        return {'created_at': execution['created_at'], 'id': execution['id']}
+
+    @staticmethod
+    def encode_execution_cursor(cursor):
+        """Cursor as a URL-safe string"""
+        if not cursor:
+            return None
+        return f"{cursor['id']}:{cursor['created_at']}"
+
+    @staticmethod
+    def decode_execution_cursor(value):
+        """Parse a cursor string from encode_execution_cursor, or None if malformed"""
+        if not value:
+            return None
+        execution_id, _, created_at = value.partition(':')
+        if not execution_id.isdigit():
+            return None
+        # Only a real timestamp may reach the filter string
+        try:
+            datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        return {'created_at': created_at, 'id': int(execution_id)}
+
+    @staticmethod
+    def create_execution_city_counts(rows):
+        """Insert per-city rows ({execution_id, subscription_id, city, leads_tagged}) in one request"""
+        return supabase.table('execution_city_counts').insert(rows).execute()
+
+    @staticmethod
+    def get_execution_city_counts(execution_id):
+        return supabase.table('execution_city_counts').select('city, leads_tagged').eq('execution_id', execution_id).order('leads_tagged', desc=True).execute()
+
+    @staticmethod
+    def get_city_counts(subscription_id, start, end=None):
+        """Leads tagged per city between start and end (default now), most tagged first
+
+        start and end are datetimes or ISO strings. Returns [{'city', 'leads_tagged'}].
+        """
+        if end is None:
+            end = datetime.now(timezone.utc)
+        result = supabase.rpc('city_counts_between', {
+            'p_subscription_id': subscription_id,
+            'p_start': start.isoformat() if isinstance(start, datetime) else start,
+            'p_end': end.isoformat() if isinstance(end, datetime) else end
+        }).execute()
+        return result.data or []
+
+    @staticmethod
+    def increment_execution_rollups(deltas):
+        """Add finished executions to the hourly and daily rollups (see rollup_delta)"""
+        return supabase.rpc('increment_execution_rollups', {'p_rows': deltas}).execute()
+
+    @staticmethod
+    def get_execution_rollups(subscription_id, period='day', since=None, limit=None):
+        query = supabase.table('execution_rollups').select('*').eq('subscription_id', subscription_id).eq('period', period)
+        if since:
+            query = query.gte('bucket_start', since)
+        query = query.order('bucket_start', desc=True)
+        if limit:
+            query = query.limit(limit)
+        return query.execute()
+
+    @staticmethod
+    def get_city_rollups(subscription_id, period='day', since=None):
+        query = supabase.table('execution_city_rollups').select('bucket_start, city, leads_tagged').eq('subscription_id', subscription_id).eq('period', period)
+        if since:
+            query = query.gte('bucket_start', since)
+        return query.order('bucket_start', desc=True).execute()
+
+    @staticmethod
+    def get_rollup_summary(subscription_id, days=30):
+        """Totals and per-city counts over the last days, from the daily rollups"""
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).date().isoformat()
+        summary = {
+            'days': days,
+            'executions': 0,
+            'failed_executions': 0,
+            'leads_processed': 0,
+            'leads_skipped': 0,
+            'cities_tagged': 0,
+            'cities': []
+        }
+        for row in Database.get_execution_rollups(subscription_id, 'day', since=since).data or []:
+            for field in ('executions', 'failed_executions', 'leads_processed', 'leads_skipped', 'cities_tagged'):
+                summary[field] += row.get(field) or 0
+
+        city_counts = {}
+        for row in Database.get_city_rollups(subscription_id, 'day', since=since).data or []:
+            city_counts[row['city']] = city_counts.get(row['city'], 0) + (row.get('leads_tagged') or 0)
+        summary['cities'] = sorted(city_counts.items(), key=lambda item: (-item[1], item[0]))
+        return summary
 
     @staticmethod
     def get_active_subscriptions():
@@ -117,14 +345,49 @@ class Database:
 
     @staticmethod
     def update_followupboss_api_key(subscription_id, api_key):
+        # A new key means a different account, so the backfill cursor no longer applies
+        result = supabase.table('subscriptions').update({
+            'followupboss_api_key': api_key,
+            'leads_cursor_created_at': None,
+            'leads_cursor_person_id': None
+        }).eq('id', subscription_id).execute()
+        # Forget the old key's entry and any cached miss for the new key
+        subscription_cache.invalidate_where('id', subscription_id)
+        subscription_cache.invalidate_api_key(api_key)
+        return result
+
+    @staticmethod
+    def get_leads_cursor(subscription_id):
+        result = supabase.table('subscriptions').select('leads_cursor_created_at, leads_cursor_person_id').eq('id', subscription_id).execute()
+        if result.data and result.data[0].get('leads_cursor_created_at'):
+            return {
+                'created': result.data[0]['leads_cursor_created_at'],
+                'id': result.data[0].get('leads_cursor_person_id')
+            }
+        return None
+
+    @staticmethod
+    def update_leads_cursor(subscription_id, cursor):
         return supabase.table('subscriptions').update({
-            'followupboss_api_key': api_key
+            'leads_cursor_created_at': cursor['created'],
+            'leads_cursor_person_id': cursor['id']
         }).eq('id', subscription_id).execute()
 
     @staticmethod
     def get_subscription_by_api_key(api_key):
         return supabase.table('subscriptions').select('*').eq('followupboss_api_key', api_key).execute()
 
+    @staticmethod
+    def get_cached_subscription_by_api_key(api_key):
+        """Subscription for an API key, or None, from the cache when fresh"""
+        found, subscription = subscription_cache.get(api_key)
+        if found:
+            return subscription
+        result = Database.get_subscription_by_api_key(api_key)
+        subscription = result.data[0] if result.data else None
+        subscription_cache.set(api_key, subscription)
+        return subscription
+
     @staticmethod
     def delete_script_execution(execution_id):
         return supabase.table('script_executions').delete().eq('id', execution_id).execute() 
\ No newline at end of file
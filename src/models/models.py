@@ -32,6 +32,9 @@ class Subscription(Base):
     stripe_customer_id = Column(String, unique=True)
     status = Column(String, nullable=False)  # active, canceled, suspended
     followupboss_api_key = Column(String)
+    market = Column(String)  # gazetteer market; None uses the default
+    leads_cursor_created_at = Column(DateTime)  # newest lead seen by the last successful backfill
+    leads_cursor_person_id = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -45,7 +48,9 @@ class ScriptExecution(Base):
     subscription_id = Column(Integer, ForeignKey('subscriptions.id'), nullable=False)
     status = Column(String, nullable=False)  # pending, running, completed, failed
     leads_processed = Column(Integer, default=0)
+    leads_skipped = Column(Integer, default=0)  # already tagged before processing
     cities_tagged = Column(Integer, default=0)
+    tag_writes_failed = Column(Integer, default=0)  # tags found but not saved to Follow Up Boss
     error_message = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime)
@@ -63,6 +68,25 @@ class Subscriber(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     last_checked = Column(DateTime)
 
+class LeadJob(Base):
+    __tablename__ = 'lead_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    lead_id = Column(String, nullable=False)
+    api_key_env = Column(String, nullable=False)  # environment variable holding the API key; the key itself is never stored
+    subscription_id = Column(Integer)
+    attempts = Column(Integer, default=0)
+    visible_at = Column(DateTime, default=datetime.utcnow, index=True)  # claimable once this passes
+    last_error = Column(Text)
+    failed_at = Column(DateTime)  # set when the job runs out of attempts
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class WebhookDelivery(Base):
+    __tablename__ = 'webhook_deliveries'
+    
+    key = Column(String, primary_key=True)  # e.g. "event:<eventId>" or "lead:<subscription>:<lead>"
+    expires_at = Column(DateTime, nullable=False, index=True)
+
 # Create database engine
 engine = create_engine('sqlite:///city_tagger.db')
 Base.metadata.create_all(engine)
@@ -0,0 +1,58 @@
+import re
+from src.services.gazetteer import get_gazetteer
+
+# Phrases that introduce a property address in notes and event messages.
+# Longer phrases come first so "interested in seeing" wins over "interested in".
+PROPERTY_PHRASES = [
+    r'interested in seeing',
+    r'interested in',
+    r'property inquiry:?',
+    r'viewed',
+    r'looking at',
+    r'inquired about',
+    r'property:',
+    r'address:'
+]
+
+# Compiled once at import
+PHRASE_PATTERN = re.compile(r'(?:' + '|'.join(PROPERTY_PHRASES) + r')\s+', re.IGNORECASE)
+
+def scan_message(message, gazetteer=None):
+    """Find the property address and city in a message
+
+    The phrase pattern and the gazetteer's automaton each make at most one
+    pass over the message. Returns {'full_address': ..., 'city': ...} for
+    the first address phrase (city only if a known city appears inside the
+    address), {'city': ...} when there is no address phrase but a known
+    city is mentioned, or None.
+    """
+    if not message:
+        return None
+    if gazetteer is None:
+        gazetteer = get_gazetteer()
+
+    for match in PHRASE_PATTERN.finditer(message):
+        start = match.end()
+        end = message.find('.', start)
+        if end == -1:
+            end = len(message)
+        address = message[start:end].strip()
+        if address:
+            result = {'full_address': address}
+            city = gazetteer.first_city(message, start, end)
+            if city:
+                result['city'] = city
+            return result
+
+    city = gazetteer.first_city(message)
+    if city:
+        return {'city': city}
+    return None
+
+def find_city(text, gazetteer=None):
+    """Find the first known city mentioned in text"""
+    if not text:
+        return None
+    if gazetteer is None:
+        gazetteer = get_gazetteer()
+    return gazetteer.first_city(text)
@@ -0,0 +1,172 @@
+import re
+import os
+from functools import lru_cache
+from src.services.gazetteer import get_gazetteer
+
+# Raw city strings cached after normalization
+CACHE_SIZE = int(os.getenv('CITY_NORMALIZE_CACHE_SIZE', 10000))
+
+# Common abbreviations in city names, keyed by lowercase token without the dot
+ABBREVIATIONS = {
+    'ft': 'fort',
+    'mt': 'mount',
+    'st': 'saint',
+    'ste': 'sainte',
+    'pt': 'point',
+    'n': 'north',
+    's': 'south',
+    'e': 'east',
+    'w': 'west',
+    'spgs': 'springs',
+    'spg': 'springs',
+    'hts': 'heights',
+    'lk': 'lake',
+    'vlg': 'village',
+    'cyn': 'canyon'
+}
+
+US_STATES = {
+    'al': 'alabama', 'ak': 'alaska', 'az': 'arizona', 'ar': 'arkansas', 'ca': 'california',
+    'co': 'colorado', 'ct': 'connecticut', 'de': 'delaware', 'fl': 'florida', 'ga': 'georgia',
+    'hi': 'hawaii', 'id': 'idaho', 'il': 'illinois', 'in': 'indiana', 'ia': 'iowa',
+    'ks': 'kansas', 'ky': 'kentucky', 'la': 'louisiana', 'me': 'maine', 'md': 'maryland',
+    'ma': 'massachusetts', 'mi': 'michigan', 'mn': 'minnesota', 'ms': 'mississippi', 'mo': 'missouri',
+    'mt': 'montana', 'ne': 'nebraska', 'nv': 'nevada', 'nh': 'new hampshire', 'nj': 'new jersey',
+    'nm': 'new mexico', 'ny': 'new york', 'nc': 'north carolina', 'nd': 'north dakota', 'oh': 'ohio',
+    'ok': 'oklahoma', 'or': 'oregon', 'pa': 'pennsylvania', 'ri': 'rhode island', 'sc': 'south carolina',
+    'sd': 'south dakota', 'tn': 'tennessee', 'tx': 'texas', 'ut': 'utah', 'vt': 'vermont',
+    'va': 'virginia', 'wa': 'washington', 'wv': 'west virginia', 'wi': 'wisconsin', 'wy': 'wyoming',
+    'dc': 'district of columbia'
+}
+STATE_NAMES = {tuple(name.split()) for name in US_STATES.values()}
+
+NON_NAME_CHARS = re.compile(r"[^a-z0-9' -]+")
+ZIP_CODE = re.compile(r'^\d{5}(?:-\d{4})?$')
+
+def max_edit_distance(name):
+    """Edits tolerated when fuzzy matching a name of this length"""
+    if len(name) < 5:
+        return 0
+    if len(name) < 9:
+        return 1
+    return 2
+
+def bounded_edit_distance(a, b, limit):
+    """Levenshtein distance between a and b, or None if it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb)
+            )
+            row_min = min(row_min, current[j])
+        if row_min > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+def clean_city_words(raw):
+    """(word as written, lowercase key without punctuation, comma part) triples, trailing ZIP codes removed"""
+    words = []
+    for part, text in enumerate(raw.split(',')):
+        for word in text.split():
+            key = ' '.join(NON_NAME_CHARS.sub(' ', word.lower().replace('.', ' ')).split())
+            if key:
+                words.append((word, key, part))
+    while len(words) > 1 and ZIP_CODE.match(words[-1][1]):
+        words.pop()
+    return words
+
+def word_keys(words):
+    return ' '.join(key for word, key, part in words).split()
+
+def strip_state(words):
+    """Drop a trailing state abbreviation, or a state name after a comma
+
+    "Fort Morgan CO" and "Fort Morgan, Colorado" both lose the state, but
+    "Fort Washington" keeps its last word.
+    """
+    if len(words) > 1 and words[-1][1] in US_STATES:
+        return words[:-1]
+    last_part = words[-1][2] if words else 0
+    state = [word for word in words if word[2] == last_part]
+    if last_part > 0 and len(state) < len(words) and tuple(word_keys(state)) in STATE_NAMES:
+        return words[:-len(state)]
+    return words
+
+def lookup_name(words):
+    """Gazetteer key for the words, with abbreviations expanded"""
+    return ' '.join(ABBREVIATIONS.get(token, token) for token in word_keys(words))
+
+def normalize_city(raw, gazetteer=None):
+    """Map a raw city string to its canonical name
+
+    "Ft. Morgan", "FORT MORGAN CO" and "Ft Morgan" all become "Fort Morgan".
+    Names are matched exactly, then within a small edit distance, against
+    the gazetteer, with abbreviations expanded only for the lookup. Unknown
+    cities keep their own spelling ("St. Louis, MO" becomes "St. Louis"),
+    minus any state and ZIP, title-cased.
+    Results are cached, so repeated values cost a dictionary lookup.
+    """
+    if not raw or not isinstance(raw, str):
+        return None
+    if gazetteer is None:
+        gazetteer = get_gazetteer()
+    return _normalize_cached(raw.strip(), gazetteer)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _normalize_cached(raw, gazetteer):
+    words = clean_city_words(raw)
+    if not words:
+        return None
+
+    # Try the name as given first so cities ending in a state code survive
+    city = gazetteer.lookup(lookup_name(words))
+    if city:
+        return city
+
+    words = strip_state(words)
+    name = lookup_name(words)
+    city = gazetteer.lookup(name)
+    if city:
+        return city
+
+    city = fuzzy_match(name, gazetteer)
+    if city:
+        print(f"Fuzzy matched city '{raw}' to {city}")
+        return city
+
+    return ' '.join(word for word, key, part in words).title()
+
+def fuzzy_match(name, gazetteer):
+    """Closest gazetteer city within the allowed edit distance, if unambiguous"""
+    limit = max_edit_distance(name)
+    if not limit:
+        return None
+
+    best = None
+    best_distance = limit + 1
+    ambiguous = False
+    for length in range(len(name) - limit, len(name) + limit + 1):
+        for candidate in gazetteer.names_by_length.get(length, ()):
+            distance = bounded_edit_distance(name, candidate, min(limit, best_distance))
+            if distance is None:
+                continue
+            if distance < best_distance:
+                best, best_distance, ambiguous = candidate, distance, False
+            elif distance == best_distance and candidate != best:
+                ambiguous = True
+
+    if best is None or ambiguous:
+        return None
+    return gazetteer.cities[best]
+
+def normalize_cache_info():
+    """Hit and miss counts for the normalization cache"""
+    return _normalize_cached.cache_info()
@@ -1,5 +1,9 @@
 from src.models.database import Database
-from src.services.zillow_lead_tagger import process_lead, process_all_leads, setup_webhook
+from src.services.zillow_lead_tagger import run_tag_lead, process_all_leads, setup_webhook
+from src.services.lead_queue import LeadJobQueue
+from src.services.gazetteer import get_gazetteer
+from src.services.zip_resolver import get_zip_resolver
+from src.services.execution_recorder import execution_recorder, utc_now
 import time
 from datetime import datetime, timedelta
 import threading
@@ -8,21 +12,39 @@ class CityTaggerService:
     def __init__(self):
         self.running = False
         self.thread = None
+        self.lead_queue = LeadJobQueue(self.process_new_lead, on_give_up=self.record_failed_lead)
 
     def start(self):
         """Start the city tagger service"""
         if not self.running:
             self.running = True
+            # Load and index the city gazetteer and ZIP table before any lead needs them
+            get_gazetteer()
+            get_zip_resolver()
             self.thread = threading.Thread(target=self._run_service)
             self.thread.daemon = True
             self.thread.start()
+            execution_recorder.start()
+            self.lead_queue.start()
 
     def stop(self):
         """Stop the city tagger service"""
         self.running = False
+        self.lead_queue.stop()
+        execution_recorder.stop()
         if self.thread:
             self.thread.join()
 
+    def enqueue_lead(self, lead_id, api_key_env, subscription_id=None):
+        """Queue a new lead to be tagged by the worker pool with the API key in api_key_env"""
+        self.lead_queue.enqueue(lead_id, api_key_env, subscription_id)
+
+    def queue_stats(self):
+        """Webhook queue depth and timing metrics, plus buffered execution records"""
+        stats = self.lead_queue.stats()
+        stats['execution_records'] = execution_recorder.stats()
+        return stats
+
     def _run_service(self):
         """Main service loop - only monitors webhook health"""
         while self.running:
@@ -49,46 +71,52 @@ class CityTaggerService:
             print(f"\nProcessing new lead {lead_id}")
             
             # Find subscription by API key
-            subscription = Database.get_subscription_by_api_key(api_key).data[0]
+            subscription = Database.get_cached_subscription_by_api_key(api_key)
             if not subscription:
                 print(f"No subscription found for API key")
                 return False
             
-            # Create execution record
-            execution = Database.create_script_execution(
-                subscription_id=subscription['id'],
-                status='running'
-            ).data[0]
+            # The execution is recorded once, when it finishes, in a batched insert
+            started_at = utc_now()
             
             try:
-                # Process the lead
-                print(f"Processing lead {lead_id} with API key {api_key}")
-                from src.services.zillow_lead_tagger import get_property_from_lead, extract_city_from_address, update_lead_tags
+                # Process the lead, sharing the run if a backfill is already on it
+                print(f"Processing lead {lead_id}")
+                status, city, _ = run_tag_lead(lead_id, api_key, gazetteer=get_gazetteer(subscription.get('market')))
                 
-                # Get property information
-                address_data = get_property_from_lead(lead_id, api_key)
+                if status == 'already_tagged':
+                    execution_recorder.record(
+                        subscription['id'],
+                        'completed',
+                        started_at=started_at,
+                        leads_processed=1,
+                        cities_tagged=0
+                    )
+                    print(f"Lead {lead_id} already has a Zillow City tag")
+                    return True
                 
-                if address_data:
-                    city = extract_city_from_address(address_data)
-                    if city:
-                        success = update_lead_tags(lead_id, city, api_key)
-                        
-                        # Update execution record
-                        if success:
-                            Database.update_script_execution(
-                                execution_id=execution['id'],
-                                status='completed',
-                                leads_processed=1,
-                                cities_tagged=1,
-                                tagged_cities=f"{city} (1)"
-                            )
-                            print(f"Successfully processed lead {lead_id} with city {city}")
-                            return True
-                
-                # If we get here, no city was found/tagged
-                Database.update_script_execution(
-                    execution_id=execution['id'],
-                    status='failed',
+                if status == 'tagged':
+                    execution_recorder.record(
+                        subscription['id'],
+                        'completed',
+                        started_at=started_at,
+                        leads_processed=1,
+                        cities_tagged=1,
+                        tagged_cities=f"{city} (1)",
+                        city_counts={city: 1}
+                    )
+                    print(f"Successfully processed lead {lead_id} with city {city}")
+                    return True
+
+                if status == 'failed':
+                    # A Follow Up Boss error is worth retrying; the queue records it if it gives up
+                    raise Exception(f"Failed to tag lead {lead_id}: Follow Up Boss request failed")
+
+                # If we get here, no city was found
+                execution_recorder.record(
+                    subscription['id'],
+                    'failed',
+                    started_at=started_at,
                     leads_processed=1,
                     cities_tagged=0,
                     error_message='Failed to process lead - no city found'
@@ -97,17 +125,25 @@ class CityTaggerService:
                 return False
                     
             except Exception as e:
+                # The queue retries the lead and records the failure if it gives up
                 print(f"Error processing lead {lead_id}: {str(e)}")
-                Database.update_script_execution(
-                    execution_id=execution['id'],
-                    status='failed',
-                    error_message=str(e)
-                )
                 raise
                 
         except Exception as e:
             print(f"Error in process_new_lead: {str(e)}")
             raise
 
+    def record_failed_lead(self, lead_id, api_key, error):
+        """Record a failed execution for a lead the queue stopped retrying"""
+        subscription = Database.get_cached_subscription_by_api_key(api_key) if api_key else None
+        if not subscription:
+            print(f"Lead {lead_id} failed with no subscription to record it against: {error}")
+            return
+        execution_recorder.record(
+            subscription['id'],
+            'failed',
+            error_message=error
+        )
+
 # Create singleton instance
 city_tagger_service = CityTaggerService() 
\ No newline at end of file
@@ -0,0 +1,184 @@
+import atexit
+import os
+import threading
+from datetime import datetime, timezone
+from src.models.database import Database
+
+# Buffered execution rows that trigger a bulk insert
+DEFAULT_BATCH_SIZE = int(os.getenv('EXECUTION_BATCH_SIZE', 50))
+
+# Longest a buffered row waits before it is written (seconds)
+DEFAULT_FLUSH_INTERVAL = float(os.getenv('EXECUTION_FLUSH_INTERVAL', 5))
+
+# Rows kept for retry while Supabase is failing; the oldest are dropped beyond this
+MAX_BUFFERED_ROWS = int(os.getenv('EXECUTION_MAX_BUFFERED', 5000))
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+def execution_row(subscription_id, status, started_at=None, leads_processed=0, cities_tagged=0, leads_skipped=0,
+                  tag_writes_failed=0, tagged_cities=None, error_message=None):
+    """A finished script_executions row
+
+    Every row carries the same columns so rows can share one bulk insert.
+    """
+    return {
+        'subscription_id': subscription_id,
+        'status': status,
+        'leads_processed': leads_processed,
+        'leads_skipped': leads_skipped,
+        'cities_tagged': cities_tagged,
+        'tag_writes_failed': tag_writes_failed,
+        'tagged_cities': tagged_cities,
+        'error_message': error_message,
+        'created_at': started_at or utc_now(),
+        'completed_at': utc_now()
+    }
+
+def rollup_delta(row, city_counts=None):
+    """What a finished execution row adds to its subscription's rollups"""
+    return {
+        'subscription_id': row['subscription_id'],
+        'completed_at': row.get('completed_at') or utc_now(),
+        'status': row['status'],
+        'leads_processed': row.get('leads_processed') or 0,
+        'leads_skipped': row.get('leads_skipped') or 0,
+        'cities_tagged': row.get('cities_tagged') or 0,
+        'city_counts': city_counts or {}
+    }
+
+def city_count_rows(execution_id, subscription_id, city_counts):
+    """execution_city_counts rows for one execution"""
+    return [
+        {'execution_id': execution_id, 'subscription_id': subscription_id, 'city': city, 'leads_tagged': count}
+        for city, count in (city_counts or {}).items()
+        if count
+    ]
+
+def save_city_counts(rows):
+    """Bulk insert per-city counts; a failure is logged, not raised"""
+    if not rows:
+        return
+    try:
+        Database.create_execution_city_counts(rows)
+    except Exception as e:
+        print(f"Error saving {len(rows)} execution city counts: {str(e)}")
+
+def add_to_rollups(deltas):
+    """Increment the rollups; a failure is logged, not raised, since the executions are saved"""
+    if not deltas:
+        return
+    try:
+        Database.increment_execution_rollups(deltas)
+    except Exception as e:
+        print(f"Error updating execution rollups for {len(deltas)} executions: {str(e)}")
+
+class ExecutionRecorder:
+    """Buffers finished execution rows and writes them with bulk inserts
+
+    A short execution that finishes within one call is recorded once,
+    with its final status, instead of an insert followed by an update.
+    Rows are flushed when batch_size are buffered or flush_interval
+    seconds pass, so dashboards lag by at most one interval. Each flush
+    also saves the rows' per-city counts and adds the rows to the hourly
+    and daily rollups.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.rows = []  # (row, rollup delta) pairs
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+        self.recorded = 0
+        self.inserted = 0
+        self.flushes = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start flushing on a timer in the background"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='execution-recorder')
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def stop(self):
+        """Stop the timer and write whatever is buffered"""
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def record(self, subscription_id, status, city_counts=None, **fields):
+        """Buffer a finished execution (fields as for execution_row)
+
+        city_counts maps each city tagged to its number of leads.
+        """
+        row = execution_row(subscription_id, status, **fields)
+        with self.lock:
+            self.rows.append((row, rollup_delta(row, city_counts)))
+            self.recorded += 1
+            full = len(self.rows) >= self.batch_size
+        if full:
+            self.wakeup.set()
+        elif not self.running:
+            # Nothing will flush on a timer, so write it now
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows in one insert"""
+        with self.flush_lock:
+            with self.lock:
+                rows, self.rows = self.rows, []
+            if not rows:
+                return 0
+            try:
+                result = Database.create_script_executions([row for row, delta in rows])
+            except Exception as e:
+                print(f"Error writing {len(rows)} execution records: {str(e)}")
+                with self.lock:
+                    # Keep them for the next flush, oldest first
+                    self.rows = rows + self.rows
+                    overflow = len(self.rows) - MAX_BUFFERED_ROWS
+                    if overflow > 0:
+                        del self.rows[:overflow]
+                        self.dropped += overflow
+                        print(f"Dropped {overflow} execution records after repeated write failures")
+                return 0
+            with self.lock:
+                self.inserted += len(rows)
+                self.flushes += 1
+            # Inserted rows come back in order, so city counts can be linked to their executions
+            city_rows = []
+            for inserted, (row, delta) in zip(result.data or [], rows):
+                city_rows.extend(city_count_rows(inserted.get('id'), row['subscription_id'], delta['city_counts']))
+            save_city_counts(city_rows)
+            add_to_rollups([delta for row, delta in rows])
+            return len(rows)
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'buffered': len(self.rows),
+                'recorded': self.recorded,
+                'inserted': self.inserted,
+                'flushes': self.flushes,
+                'dropped': self.dropped
+            }
+
+# Shared recorder for webhook lead executions
+execution_recorder = ExecutionRecorder()
@@ -0,0 +1,147 @@
+import requests
+from requests.adapters import HTTPAdapter
+import base64
+import threading
+import os
+from src.services.rate_limiter import RateLimiter
+
+API_BASE_URL = "https://api.followupboss.com/v1"
+
+# Connection pool and timeout defaults, overridable from the environment
+DEFAULT_POOL_SIZE = int(os.getenv('FUB_POOL_SIZE', 20))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv('FUB_CONNECT_TIMEOUT', 5))
+DEFAULT_READ_TIMEOUT = float(os.getenv('FUB_READ_TIMEOUT', 30))
+
+# How many times a throttled (429) request is retried before giving up
+DEFAULT_MAX_RETRIES = int(os.getenv('FUB_MAX_RETRIES', 5))
+
+class FollowUpBossError(Exception):
+    """Raised when a Follow Up Boss request fails in a way the caller can't skip"""
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+def is_valid_api_key(api_key):
+    """Basic sanity check for a Follow Up Boss API key"""
+    return bool(api_key) and isinstance(api_key, str) and len(api_key) >= 10
+
+class FollowUpBossClient:
+    """Keep-alive HTTP client for a single Follow Up Boss API key"""
+
+    def __init__(self, api_key, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+
+        # Shared by every thread using this key
+        self.rate_limiter = RateLimiter()
+
+        # Build the Basic Auth header once per key
+        auth_string = f"{api_key}:"  # Note the colon at the end
+        auth_bytes = auth_string.encode('ascii')
+        base64_auth = base64.b64encode(auth_bytes).decode('ascii')
+
+        self.headers = {
+            'Authorization': f'Basic {base64_auth}',
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'X-System': 'city_tagger'  # Required system identifier
+        }
+
+        # Reuse TCP+TLS connections across calls
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def url(self, path):
+        """Build a full API URL from a path like '/people/123'"""
+        if path.startswith('http'):
+            return path
+        return f"{API_BASE_URL}/{path.lstrip('/')}"
+
+    def request(self, method, path, **kwargs):
+        """Send a rate-limited request, retrying when throttled"""
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.url(path)
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            response = self.session.request(method, url, **kwargs)
+            retry_after = self.rate_limiter.update(response, attempt)
+
+            if response.status_code != 429 or attempt >= self.max_retries:
+                return response
+
+            attempt += 1
+            print(f"Rate limited on {method} {path}, retrying in {retry_after:.1f}s (attempt {attempt}/{self.max_retries})")
+
+    def get(self, path, params=None, **kwargs):
+        return self.request('GET', path, params=params, **kwargs)
+
+    def put(self, path, json=None, **kwargs):
+        return self.request('PUT', path, json=json, **kwargs)
+
+    def post(self, path, json=None, **kwargs):
+        return self.request('POST', path, json=json, **kwargs)
+
+    def iter_pages(self, path, collection, params=None, limit=100, offset=0):
+        """Yield each page of an offset-paginated list endpoint
+        
+        collection is the key holding the page items (e.g. 'people').
+        offset skips items already read, e.g. from a smaller first page.
+        Raises FollowUpBossError if a page request fails.
+        """
+        while True:
+            page_params = dict(params or {})
+            page_params['limit'] = limit
+            page_params['offset'] = offset
+
+            response = self.get(path, params=page_params)
+            if response.status_code != 200:
+                print(f"Error getting {collection}: {response.status_code}")
+                print(f"Response: {response.text}")
+                raise FollowUpBossError(f"Error getting {collection}: {response.status_code}", response)
+
+            items = response.json().get(collection, [])
+            if not items:  # No more items to fetch
+                return
+
+            yield items
+
+            # Check if we've reached the end
+            if len(items) < limit:
+                return
+
+            offset += limit
+
+    def close(self):
+        self.session.close()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(api_key):
+    """Get the shared client for an API key, creating it on first use"""
+    if not is_valid_api_key(api_key):
+        print("Invalid API key format - cannot create Follow Up Boss client")
+        return None
+
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = FollowUpBossClient(api_key)
+            _clients[api_key] = client
+        return client
+
+def close_clients():
+    """Close all pooled sessions"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
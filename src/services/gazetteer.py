@@ -0,0 +1,150 @@
+import csv
+import os
+import threading
+
+# Gazetteer files live in config/gazetteers/<market>.csv with a city,state header
+GAZETTEER_DIR = os.getenv(
+    'CITY_GAZETTEER_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'config', 'gazetteers')
+)
+DEFAULT_MARKET = os.getenv('CITY_GAZETTEER_MARKET', 'default')
+
+class CityIndex:
+    """Aho-Corasick automaton over lowercase names
+
+    Matching costs O(text length + matches) whatever the number of names,
+    so adding markets doesn't slow down message scanning.
+    """
+
+    def __init__(self, names):
+        # names maps a lowercase name to the value reported for it
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for name, value in names.items():
+            node = 0
+            for ch in name:
+                next_node = self.goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][ch] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append((len(name), value))
+
+        # Breadth-first pass to link each node to its longest proper suffix
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                if node:
+                    fallback = self.fail[node]
+                    while fallback and ch not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find_all(self, text, start=0, end=None):
+        """Return (start, end, value) for whole-word matches, leftmost-longest"""
+        if end is None:
+            end = len(text)
+
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        matches = []
+        node = 0
+        for i in range(start, end):
+            ch = text[i].lower()
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if output[node]:
+                for length, value in output[node]:
+                    match_start = i - length + 1
+                    if _is_boundary(text, match_start - 1) and _is_boundary(text, i + 1):
+                        matches.append((match_start, i + 1, value))
+
+        # Keep the leftmost, then longest, non-overlapping matches
+        matches.sort(key=lambda match: (match[0], match[0] - match[1]))
+        selected = []
+        last_end = -1
+        for match in matches:
+            if match[0] >= last_end:
+                selected.append(match)
+                last_end = match[1]
+        return selected
+
+def _is_boundary(text, position):
+    return position < 0 or position >= len(text) or not text[position].isalnum()
+
+class Gazetteer:
+    """City names for a market, indexed for fast matching
+
+    A subscription's market column picks its gazetteer.
+    """
+
+    def __init__(self, rows, market=DEFAULT_MARKET):
+        self.market = market
+        self.cities = {}  # lowercase name -> canonical city name
+        for row in rows:
+            city = (row.get('city') or '').strip()
+            if city:
+                self.cities.setdefault(' '.join(city.lower().split()), city)
+        self.index = CityIndex(self.cities)
+
+        # Candidate names grouped by length for bounded fuzzy matching
+        self.names_by_length = {}
+        for name in self.cities:
+            self.names_by_length.setdefault(len(name), []).append(name)
+
+    def __len__(self):
+        return len(self.cities)
+
+    def find_cities(self, text, start=0, end=None):
+        """All known cities mentioned in text[start:end] as (start, end, city)"""
+        if not text:
+            return []
+        return self.index.find_all(text, start, end)
+
+    def first_city(self, text, start=0, end=None):
+        """First known city mentioned in text[start:end], or None"""
+        matches = self.find_cities(text, start, end)
+        return matches[0][2] if matches else None
+
+    def lookup(self, name):
+        """Exact (case and spacing insensitive) lookup of a city name"""
+        if not name:
+            return None
+        return self.cities.get(' '.join(name.lower().split()))
+
+def load_gazetteer(path, market=DEFAULT_MARKET):
+    """Load a gazetteer CSV with city and state columns"""
+    with open(path, newline='', encoding='utf-8') as f:
+        gazetteer = Gazetteer(csv.DictReader(f), market=market)
+    print(f"Loaded {len(gazetteer)} cities for market '{market}' from {path}")
+    return gazetteer
+
+_gazetteers = {}
+_gazetteers_lock = threading.Lock()
+
+def get_gazetteer(market=None):
+    """Get the gazetteer for a market, loading and indexing it once"""
+    market = market or DEFAULT_MARKET
+    with _gazetteers_lock:
+        gazetteer = _gazetteers.get(market)
+        if gazetteer is None:
+            path = os.path.join(GAZETTEER_DIR, f"{market}.csv")
+            if market != DEFAULT_MARKET and not os.path.exists(path):
+                print(f"No gazetteer for market '{market}', using '{DEFAULT_MARKET}'")
+                gazetteer = _gazetteers.get(DEFAULT_MARKET)
+                if gazetteer is None:
+                    gazetteer = load_gazetteer(os.path.join(GAZETTEER_DIR, f"{DEFAULT_MARKET}.csv"), DEFAULT_MARKET)
+                    _gazetteers[DEFAULT_MARKET] = gazetteer
+            else:
+                gazetteer = load_gazetteer(path, market)
+            _gazetteers[market] = gazetteer
+        return gazetteer
@@ -0,0 +1,255 @@
+import threading
+import time
+import os
+from datetime import datetime, timedelta
+from src.models.models import Session, LeadJob
+
+# Number of worker threads draining webhook lead jobs
+DEFAULT_WORKERS = int(os.getenv('WEBHOOK_QUEUE_WORKERS', 4))
+
+# Seconds a claimed job stays hidden before another worker may retry it
+DEFAULT_VISIBILITY_TIMEOUT = int(os.getenv('WEBHOOK_JOB_VISIBILITY_TIMEOUT', 300))
+
+# Attempts before a job that keeps raising is parked as failed
+DEFAULT_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_JOB_MAX_ATTEMPTS', 5))
+
+# How often idle workers look for jobs enqueued by other processes
+POLL_INTERVAL = 1.0
+
+class LeadJobStore:
+    """Durable lead-tagging jobs in the local SQLite database
+
+    Delivery is at-least-once: a claimed job is hidden for the visibility
+    timeout and deleted only when acknowledged, so a job whose worker dies
+    becomes claimable again once the timeout passes. Jobs refer to their
+    API key by the environment variable that holds it, so no key is
+    written to disk.
+    """
+
+    def add(self, lead_id, api_key_env, subscription_id=None):
+        with Session() as session:
+            job = LeadJob(
+                lead_id=str(lead_id),
+                api_key_env=api_key_env,
+                subscription_id=subscription_id,
+                attempts=0,
+                visible_at=datetime.utcnow()
+            )
+            session.add(job)
+            session.commit()
+            return job.id
+
+    def claim(self, visibility_timeout):
+        """Claim the oldest visible job, or return None"""
+        with Session() as session:
+            # Another worker or process may win the race for a job, so try a few
+            for _ in range(3):
+                now = datetime.utcnow()
+                job = session.query(LeadJob).filter(
+                    LeadJob.failed_at.is_(None),
+                    LeadJob.visible_at <= now
+                ).order_by(LeadJob.id).first()
+                if not job:
+                    return None
+
+                # Snapshot before the commit expires the instance
+                claimed_job = {
+                    'id': job.id,
+                    'lead_id': job.lead_id,
+                    'api_key_env': job.api_key_env,
+                    'subscription_id': job.subscription_id,
+                    'attempts': (job.attempts or 0) + 1,
+                    'created_at': job.created_at
+                }
+
+                claimed = session.query(LeadJob).filter(
+                    LeadJob.id == job.id,
+                    LeadJob.visible_at == job.visible_at
+                ).update({
+                    'visible_at': now + timedelta(seconds=visibility_timeout),
+                    'attempts': LeadJob.attempts + 1
+                }, synchronize_session=False)
+                session.commit()
+
+                if claimed == 1:
+                    return claimed_job
+        return None
+
+    def ack(self, job_id):
+        """Remove a finished job"""
+        with Session() as session:
+            session.query(LeadJob).filter(LeadJob.id == job_id).delete(synchronize_session=False)
+            session.commit()
+
+    def retry(self, job_id, attempts, error, max_attempts):
+        """Make a failed job visible again after a backoff, or park it"""
+        now = datetime.utcnow()
+        if attempts >= max_attempts:
+            update = {'failed_at': now, 'last_error': error}
+        else:
+            backoff = min(300, 5 * (2 ** (attempts - 1)))
+            update = {'visible_at': now + timedelta(seconds=backoff), 'last_error': error}
+
+        with Session() as session:
+            session.query(LeadJob).filter(LeadJob.id == job_id).update(update, synchronize_session=False)
+            session.commit()
+
+    def counts(self):
+        """Pending (claimable), leased or delayed, and failed job counts"""
+        now = datetime.utcnow()
+        with Session() as session:
+            active = session.query(LeadJob).filter(LeadJob.failed_at.is_(None))
+            return {
+                'pending': active.filter(LeadJob.visible_at <= now).count(),
+                'leased': active.filter(LeadJob.visible_at > now).count(),
+                'dead': session.query(LeadJob).filter(LeadJob.failed_at.isnot(None)).count()
+            }
+
+class LeadJobQueue:
+    """Durable queue of lead-tagging jobs drained by a worker pool"""
+
+    def __init__(self, handler, workers=DEFAULT_WORKERS, store=None,
+                 visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, max_attempts=DEFAULT_MAX_ATTEMPTS, on_give_up=None):
+        self.handler = handler  # called as handler(lead_id, api_key)
+        self.on_give_up = on_give_up  # called as on_give_up(lead_id, api_key, error) when a job is parked
+        self.workers = max(1, workers)
+        self.store = store or LeadJobStore()
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.wakeup = threading.Event()
+        self.threads = []
+        self.running = False
+
+        # Metrics
+        self.lock = threading.Lock()
+        self.enqueued = 0
+        self.processed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.errored = 0
+        self.in_progress = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_processing = 0.0
+        self.max_processing = 0.0
+
+    def start(self):
+        """Start the worker threads, replaying jobs left over from a previous run"""
+        if self.running:
+            return
+        self.running = True
+
+        counts = self.store.counts()
+        if counts['pending'] or counts['leased']:
+            print(f"Replaying {counts['pending']} pending and {counts['leased']} in-flight lead jobs")
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'lead-queue-{i}')
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Stop the worker threads once they finish their current job"""
+        self.running = False
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def enqueue(self, lead_id, api_key_env, subscription_id=None):
+        """Persist a lead job and return immediately; api_key_env names the variable holding the API key"""
+        self.store.add(lead_id, api_key_env, subscription_id)
+        with self.lock:
+            self.enqueued += 1
+        self.wakeup.set()
+
+    def _worker(self):
+        while self.running:
+            try:
+                job = self.store.claim(self.visibility_timeout)
+            except Exception as e:
+                print(f"Error claiming lead job: {str(e)}")
+                job = None
+
+            if not job:
+                self.wakeup.wait(POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+
+            self._run(job)
+
+    def _run(self, job):
+        started_at = time.monotonic()
+        wait_time = max(0.0, (datetime.utcnow() - job['created_at']).total_seconds()) if job['created_at'] else 0.0
+        with self.lock:
+            self.in_progress += 1
+
+        success = False
+        error = None
+        api_key = None
+        try:
+            # The key is looked up when the job runs, so it is never persisted
+            api_key = os.getenv(job['api_key_env'])
+            if not api_key:
+                raise Exception(f"{job['api_key_env']} is not configured")
+            # A False result (e.g. no city found) is final; only exceptions are retried
+            success = bool(self.handler(job['lead_id'], api_key))
+        except Exception as e:
+            error = str(e)
+            print(f"Error processing queued lead {job['lead_id']} (attempt {job['attempts']}): {error}")
+
+        gave_up = False
+        try:
+            if error is None:
+                self.store.ack(job['id'])
+            else:
+                self.store.retry(job['id'], job['attempts'], error, self.max_attempts)
+                gave_up = job['attempts'] >= self.max_attempts
+        except Exception as e:
+            # The visibility timeout will make the job claimable again
+            print(f"Error updating lead job {job['id']}: {str(e)}")
+
+        # Failures are reported once, when retrying stops, not on every attempt
+        if gave_up and self.on_give_up:
+            try:
+                self.on_give_up(job['lead_id'], api_key, error)
+            except Exception as e:
+                print(f"Error reporting failed lead job {job['id']}: {str(e)}")
+
+        processing_time = time.monotonic() - started_at
+        with self.lock:
+            self.in_progress -= 1
+            self.processed += 1
+            if success:
+                self.succeeded += 1
+            elif error is not None:
+                self.errored += 1
+            else:
+                self.failed += 1
+            self.total_wait += wait_time
+            self.max_wait = max(self.max_wait, wait_time)
+            self.total_processing += processing_time
+            self.max_processing = max(self.max_processing, processing_time)
+
+    def stats(self):
+        """Current queue depth and timing metrics (times in seconds)"""
+        counts = self.store.counts()
+        with self.lock:
+            processed = self.processed
+            return {
+                'depth': counts['pending'],
+                'leased': counts['leased'],
+                'dead': counts['dead'],
+                'in_progress': self.in_progress,
+                'workers': self.workers,
+                'enqueued': self.enqueued,
+                'processed': processed,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'errored': self.errored,
+                'avg_wait': self.total_wait / processed if processed else 0.0,
+                'max_wait': self.max_wait,
+                'avg_processing': self.total_processing / processed if processed else 0.0,
+                'max_processing': self.max_processing
+            }
@@ -0,0 +1,102 @@
+import threading
+import time
+import os
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# Follow Up Boss allows a fixed number of requests per rolling window
+DEFAULT_RATE_LIMIT = int(os.getenv('FUB_RATE_LIMIT', 250))
+DEFAULT_RATE_WINDOW = float(os.getenv('FUB_RATE_WINDOW', 10))
+
+# Backoff used for a 429 that carries no Retry-After header
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def parse_header_number(value):
+    """Parse a numeric rate-limit header, or None if it is missing or malformed"""
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number >= 0 else None
+
+class RateLimiter:
+    """Token bucket shared by every caller using the same API key"""
+
+    def __init__(self, limit=DEFAULT_RATE_LIMIT, window=DEFAULT_RATE_WINDOW):
+        self.capacity = float(limit)
+        self.rate = limit / window  # tokens per second
+        self.tokens = float(limit)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def update(self, response, attempt=0):
+        """Adjust the bucket from Follow Up Boss rate-limit headers"""
+        headers = response.headers
+        limit = headers.get('X-RateLimit-Limit')
+        remaining = headers.get('X-RateLimit-Remaining')
+        window = headers.get('X-RateLimit-Window')
+
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            # Each header is parsed on its own so one malformed value doesn't hide the others
+            limit = parse_header_number(limit)
+            window = parse_header_number(window)
+            remaining = parse_header_number(remaining)
+            if limit and window:
+                self.capacity = limit
+                self.rate = limit / window
+            if remaining is not None:
+                # The server knows about requests from other processes too
+                self.tokens = min(self.tokens, remaining)
+
+            if response.status_code == 429:
+                self.tokens = 0.0
+                retry_after = parse_retry_after(headers.get('Retry-After'))
+                if retry_after is None:
+                    retry_after = min(MAX_BACKOFF, MIN_BACKOFF * (2 ** attempt))
+                self.paused_until = max(self.paused_until, now + retry_after)
+                return retry_after
+        return None
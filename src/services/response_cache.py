@@ -0,0 +1,85 @@
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a cached Follow Up Boss response stays fresh
+DEFAULT_TTL = float(os.getenv('FUB_CACHE_TTL', 60))
+
+# Most responses kept before the least recently used are evicted
+DEFAULT_MAX_ENTRIES = int(os.getenv('FUB_CACHE_MAX_ENTRIES', 5000))
+
+def hash_api_key(api_key):
+    """Short stable digest so raw API keys are never held as cache keys"""
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+
+class ResponseCache:
+    """Bounded LRU cache of API responses with a per-entry TTL
+
+    Entries are keyed by (api key, resource), e.g. (key, 'people/123'),
+    so accounts never see each other's data. Values are copied on the way
+    in and out, so callers can't modify a cached record.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, api_key, resource):
+        """Cached value, or None on a miss or expired entry"""
+        key = (hash_api_key(api_key), resource)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            value = entry[1]
+        return copy.deepcopy(value)
+
+    def set(self, api_key, resource, value):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        key = (hash_api_key(api_key), resource)
+        value = copy.deepcopy(value)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, api_key, resource):
+        """Drop a resource after we change it"""
+        with self.lock:
+            self.entries.pop((hash_api_key(api_key), resource), None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+# Shared cache for the tagger's person and events lookups
+response_cache = ResponseCache()
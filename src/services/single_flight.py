@@ -0,0 +1,68 @@
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.on_wait = None  # Called by each caller that joins, e.g. to hurry the leader along
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one execution
+
+    The first caller to begin() a key leads the flight; callers arriving
+    while it is in flight wait and receive the result (or exception) the
+    leader passes to finish(). Nothing is cached afterwards, so the next
+    call after completion runs again. The leader may finish later than it
+    returns, e.g. once a queued write is done.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def begin(self, key):
+        """Start a flight for key, or join the one in flight; returns (call, leader)"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.shared += 1
+                call.waiters += 1
+                return call, False
+            call = _Call()
+            self.calls[key] = call
+            self.executed += 1
+            return call, True
+
+    def has_waiters(self, call):
+        with self.lock:
+            return call.waiters > 0
+
+    def wait(self, call):
+        """Wait for a joined flight and return its result (or raise its exception)"""
+        if call.on_wait is not None:
+            call.on_wait()
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def finish(self, key, call, result=None, error=None):
+        """End the leader's flight and hand its result to everyone waiting"""
+        call.result = result
+        call.error = error
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+        call.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': len(self.calls),
+                'executed': self.executed,
+                'shared': self.shared
+            }
@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from src.services.followupboss_client import get_client
+from src.services.response_cache import response_cache
+from src.services.zillow_lead_tagger import get_tag_list
+
+# Parallel PUTs per writer
+DEFAULT_CONCURRENCY = int(os.getenv('TAG_WRITER_CONCURRENCY', 4))
+
+# Pending people that trigger a flush
+DEFAULT_BATCH_SIZE = int(os.getenv('TAG_WRITER_BATCH_SIZE', 50))
+
+# Attempts per PUT for server errors and network failures (429s are retried by the client)
+DEFAULT_MAX_ATTEMPTS = int(os.getenv('TAG_WRITER_MAX_ATTEMPTS', 3))
+
+class TagWriter:
+    """Write-behind buffer of tag changes for one Follow Up Boss account
+
+    Callers queue mutations (functions from a tag list to a new tag list)
+    and carry on; mutations for the same person are merged and written
+    with a single PUT. Writes start once batch_size people are pending and
+    run on a small thread pool, so extraction is never waiting on them
+    unless the writes fall far behind. Each person's tags are read just
+    before their PUT, not taken from the caller, so a late write doesn't
+    drop tags added in the meantime. close() flushes everything and
+    returns the outcome for each person.
+    """
+
+    def __init__(self, api_key, concurrency=None, batch_size=None, max_attempts=None):
+        self.api_key = api_key
+        self.client = get_client(api_key)
+        self.concurrency = max(1, concurrency or DEFAULT_CONCURRENCY)
+        self.batch_size = max(1, batch_size or DEFAULT_BATCH_SIZE)
+        self.max_attempts = max(1, max_attempts or DEFAULT_MAX_ATTEMPTS)
+
+        self.lock = threading.Lock()
+        self.pending = {}  # lead_id -> {'mutations', 'context', 'callbacks'}
+        self.writing = set()
+        self.outcomes = {}  # lead_id -> {'status', 'ok', 'context', 'error'}
+        self.futures = set()
+
+        # Caps queued writes so a stalled API pushes back on the producer
+        self.slots = threading.BoundedSemaphore(self.concurrency * 2)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='tag-writer')
+
+    def mutate(self, lead_id, mutation, context=None, on_done=None):
+        """Queue a tag change for a person
+
+        context is handed back in the outcome (e.g. the city being tagged).
+        on_done is called with the outcome once the write finishes.
+        """
+        with self.lock:
+            entry = self.pending.get(lead_id)
+            if entry is None:
+                entry = {'mutations': [], 'context': None, 'callbacks': []}
+                self.pending[lead_id] = entry
+            entry['mutations'].append(mutation)
+            if context is not None:
+                entry['context'] = context
+            if on_done is not None:
+                entry['callbacks'].append(on_done)
+            should_flush = len(self.pending) >= self.batch_size
+
+        if should_flush:
+            self.flush()
+
+    def add_tag(self, lead_id, tag, context=None):
+        def add(tags):
+            return tags if tag in tags else tags + [tag]
+        self.mutate(lead_id, add, context)
+
+    def remove_tags(self, lead_id, prefix, context=None):
+        def remove(tags):
+            return [t for t in tags if not t.startswith(prefix)]
+        self.mutate(lead_id, remove, context)
+
+    def flush(self):
+        """Start writing everything pending that isn't already being written"""
+        with self.lock:
+            batch = []
+            for lead_id in list(self.pending):
+                if lead_id not in self.writing:
+                    batch.append((lead_id, self.pending.pop(lead_id)))
+                    self.writing.add(lead_id)
+
+        for lead_id, entry in batch:
+            self.slots.acquire()
+            future = self.executor.submit(self._write, lead_id, entry)
+            with self.lock:
+                self.futures.add(future)
+                self.futures = {f for f in self.futures if not f.done()}
+
+    def close(self):
+        """Flush, wait for every write and return the outcomes by lead id"""
+        while True:
+            self.flush()
+            with self.lock:
+                futures = set(self.futures)
+            wait(futures)
+            with self.lock:
+                if not self.pending and not self.writing:
+                    break
+        self.executor.shutdown(wait=True)
+        return dict(self.outcomes)
+
+    def _write(self, lead_id, entry):
+        outcome = {'status': 'failed', 'ok': False, 'context': entry['context'], 'error': None}
+        try:
+            tags = self._fetch_tags(lead_id)
+
+            new_tags = tags
+            for mutation in entry['mutations']:
+                new_tags = mutation(new_tags)
+
+            if new_tags == tags:
+                outcome.update(status='unchanged', ok=True)
+            else:
+                self._put_tags(lead_id, new_tags)
+                outcome.update(status='written', ok=True)
+        except Exception as e:
+            outcome['error'] = str(e)
+            print(f"Error writing tags for lead {lead_id}: {str(e)}")
+        finally:
+            with self.lock:
+                self.writing.discard(lead_id)
+                self.outcomes[lead_id] = outcome
+            self.slots.release()
+            for callback in entry['callbacks']:
+                try:
+                    callback(outcome)
+                except Exception as e:
+                    print(f"Error in tag write callback for lead {lead_id}: {str(e)}")
+
+    def _fetch_tags(self, lead_id):
+        response = self.client.get(f"/people/{lead_id}")
+        if response.status_code != 200:
+            raise Exception(f"Error getting lead {lead_id}: {response.status_code}")
+        return get_tag_list(response.json().get('tags', []))
+
+    def _put_tags(self, lead_id, tags):
+        for attempt in range(1, self.max_attempts + 1):
+            error = None
+            try:
+                response = self.client.put(f"/people/{lead_id}", json={'tags': tags})
+                response_cache.invalidate(self.api_key, f"people/{lead_id}")
+                if response.status_code == 200:
+                    return
+                error = f"{response.status_code}: {response.text}"
+                if response.status_code < 500 and response.status_code != 429:
+                    break  # Retrying won't fix a client error
+            except Exception as e:
+                error = str(e)
+            if attempt < self.max_attempts:
+                time.sleep(min(10, 2 ** (attempt - 1)))
+        raise Exception(f"Error updating lead {lead_id}: {error}")
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from src.models.models import Session, WebhookDelivery
+
+# Seconds a webhook delivery is remembered
+DEFAULT_TTL = int(os.getenv('WEBHOOK_DEDUP_TTL', 3600))
+
+# Most deliveries remembered in memory before the oldest are dropped
+DEFAULT_MAX_ENTRIES = int(os.getenv('WEBHOOK_DEDUP_MAX_ENTRIES', 10000))
+
+# Also record deliveries in the local SQLite database so restarts and other workers see them
+DEFAULT_PERSIST = os.getenv('WEBHOOK_DEDUP_PERSIST', 'true').lower() == 'true'
+
+# Expired rows are purged at most this often (seconds)
+PURGE_INTERVAL = 60
+
+def event_key(event_id):
+    return f"event:{event_id}"
+
+def lead_key(subscription_id, lead_id):
+    return f"lead:{subscription_id}:{lead_id}"
+
+class WebhookDeduplicator:
+    """Remembers recent webhook deliveries so retries skip the work
+
+    Keys live in a bounded in-memory map with a TTL and, when persist is
+    on, in the webhook_deliveries table, whose primary key also settles
+    races between worker processes.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, persist=DEFAULT_PERSIST):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist = persist
+        self.entries = OrderedDict()  # key -> expiry (epoch seconds)
+        self.lock = threading.Lock()
+        self.last_purge = 0.0
+        self.accepted = 0
+        self.duplicates = 0
+
+    def seen(self, key):
+        """Check whether a key was recorded and hasn't expired, without recording it"""
+        with self.lock:
+            if self._seen_in_memory(key):
+                return True
+        if self.persist:
+            try:
+                with Session() as session:
+                    row = session.get(WebhookDelivery, key)
+                    return row is not None and row.expires_at > datetime.utcnow()
+            except Exception as e:
+                print(f"Error checking webhook delivery {key}: {str(e)}")
+        return False
+
+    def check_and_mark(self, key):
+        """Record a key, returning True if it was already recorded (a duplicate)"""
+        with self.lock:
+            if self._seen_in_memory(key):
+                self.duplicates += 1
+                return True
+
+            if self.persist and not self._store(key):
+                self._remember(key)
+                self.duplicates += 1
+                return True
+
+            self._remember(key)
+            self.accepted += 1
+            return False
+
+    def forget(self, key):
+        """Drop a key so a retry of work that failed to queue goes through"""
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.persist:
+            try:
+                with Session() as session:
+                    session.query(WebhookDelivery).filter(WebhookDelivery.key == key).delete(synchronize_session=False)
+                    session.commit()
+            except Exception as e:
+                print(f"Error forgetting webhook delivery {key}: {str(e)}")
+
+    def _seen_in_memory(self, key):
+        expires_at = self.entries.get(key)
+        if expires_at is None:
+            return False
+        if expires_at > time.time():
+            return True
+        del self.entries[key]
+        return False
+
+    def _remember(self, key):
+        self.entries[key] = time.time() + self.ttl
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _store(self, key):
+        """Insert the key, returning False if a live row already exists"""
+        now = datetime.utcnow()
+        try:
+            with Session() as session:
+                row = session.get(WebhookDelivery, key)
+                if row is not None and row.expires_at > now:
+                    return False
+                if row is not None:
+                    row.expires_at = now + timedelta(seconds=self.ttl)
+                else:
+                    session.add(WebhookDelivery(key=key, expires_at=now + timedelta(seconds=self.ttl)))
+
+                if time.time() - self.last_purge > PURGE_INTERVAL:
+                    self.last_purge = time.time()
+                    session.query(WebhookDelivery).filter(
+                        WebhookDelivery.expires_at <= now,
+                        WebhookDelivery.key != key
+                    ).delete(synchronize_session=False)
+                session.commit()
+                return True
+        except IntegrityError:
+            # Another process recorded it first
+            return False
+        except Exception as e:
+            # Fall back to memory only rather than dropping the delivery
+            print(f"Error recording webhook delivery {key}: {str(e)}")
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'remembered': len(self.entries),
+                'accepted': self.accepted,
+                'duplicates': self.duplicates,
+                'persisted': self.persist
+            }
+
+# Shared by the webhook endpoint
+webhook_deduplicator = WebhookDeduplicator()
@@ -1,26 +1,50 @@
-import requests
-import json
-import base64
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import re
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src.services.followupboss_client import get_client, FollowUpBossError
+from src.services.address_extractor import scan_message, find_city
+from src.services.gazetteer import get_gazetteer
+from src.services.city_normalizer import normalize_city
+from src.services.zip_resolver import get_zip_resolver
+from src.services.response_cache import response_cache, hash_api_key
+from src.services.single_flight import SingleFlight
+
+# Number of leads processed in parallel during a backfill
+DEFAULT_CONCURRENCY = int(os.getenv('CITY_TAGGER_CONCURRENCY', 8))
+
+# Number of people pages fetched ahead of the workers (0 disables read-ahead)
+DEFAULT_PREFETCH_PAGES = int(os.getenv('CITY_TAGGER_PREFETCH_PAGES', 2))
+
+# Newest events checked before paging deeper; Zillow's inquiry is usually the first
+FIRST_EVENTS_PAGE = int(os.getenv('CITY_TAGGER_FIRST_EVENTS', 10))
+
+# Most events scanned per lead when the first page has no property
+MAX_EVENTS_SCANNED = int(os.getenv('CITY_TAGGER_MAX_EVENTS', 100))
+
+# Fetch Zillow events for a whole backfill in one sweep instead of per lead
+DEFAULT_BULK_EVENTS = os.getenv('CITY_TAGGER_BULK_EVENTS', 'true').lower() == 'true'
+
+# How far back a full backfill sweeps the events feed; older leads fall back to per-lead calls
+BULK_EVENTS_WINDOW_DAYS = int(os.getenv('CITY_TAGGER_BULK_EVENTS_DAYS', 90))
+
+# Leads created within this many days that couldn't be tagged hold the incremental cursor back so they are retried
+UNRESOLVED_RETRY_DAYS = int(os.getenv('CITY_TAGGER_RETRY_DAYS', 7))
+
+# Extraction stages, cheapest first
+EXTRACTION_STAGES = ['list', 'bulk_events', 'person', 'events', 'events_deep']
+
+# Concurrent tagging of the same lead (webhook and backfill) shares one run
+lead_flights = SingleFlight()
 
 def get_headers(api_key):
     """Create headers for Follow Up Boss API"""
-    if not api_key or not isinstance(api_key, str) or len(api_key) < 10:
-        print(f"Invalid API key format in get_headers: {api_key}")
+    client = get_client(api_key)
+    if not client:
         return None
-        
-    auth_string = f"{api_key}:"  # Note the colon at the end
-    auth_bytes = auth_string.encode('ascii')
-    base64_auth = base64.b64encode(auth_bytes).decode('ascii')
-    
-    return {
-        'Authorization': f'Basic {base64_auth}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'X-System': 'city_tagger'  # Required system identifier
-    }
+    return client.headers
 
 def setup_webhook(api_key):
     """Set up webhook in Follow Up Boss"""
@@ -31,18 +55,7 @@ def setup_webhook(api_key):
     # Get webhook domain from environment
     webhook_domain = os.getenv('E8SCRIPTS_URL', 'https://e8scripts.io')
     
-    # Create auth string for Basic Auth
-    auth_string = f"{api_key}:"  # Note the colon at the end
-    auth_bytes = auth_string.encode('ascii')
-    base64_auth = base64.b64encode(auth_bytes).decode('ascii')
-    
-    # Configure headers per FUB docs
-    headers = {
-        'Authorization': f'Basic {base64_auth}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'X-System': 'city_tagger'  # Required system identifier
-    }
+    client = get_client(api_key)
     
     # Configure webhook - simplified to match docs
     webhook_data = {
@@ -50,11 +63,11 @@ def setup_webhook(api_key):
         "url": f"{webhook_domain}/webhook/followupboss"
     }
     
-    endpoint = "https://api.followupboss.com/v1/webhooks"
+    endpoint = "/webhooks"
     
     # First, check if webhook already exists
     try:
-        response = requests.get(endpoint, headers=headers)
+        response = client.get(endpoint)
         if response.status_code == 200:
             webhooks = response.json()
             if isinstance(webhooks, list):
@@ -65,7 +78,7 @@ def setup_webhook(api_key):
                         return webhook['id']
         
         # Create new webhook if it doesn't exist
-        response = requests.post(endpoint, headers=headers, json=webhook_data)
+        response = client.post(endpoint, json=webhook_data)
         
         # Check for various success scenarios
         if response.status_code == 200 or response.status_code == 201:
@@ -91,97 +104,346 @@ def setup_webhook(api_key):
         print(f"Error setting up webhook: {str(e)}")
         return None
 
-def get_zillow_leads(api_key):
-    """Get all leads from Follow Up Boss with source 'Zillow'"""
-    endpoint = "https://api.followupboss.com/v1/people"
-    headers = get_headers(api_key)
-    if not headers:
-        print("Failed to create headers - invalid API key")
-        return []
+def parse_fub_timestamp(value):
+    """Parse an ISO timestamp from Follow Up Boss (e.g. 2024-01-31T18:02:33Z)"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+def get_lead_cursor(lead):
+    """Build a high-water mark cursor from a lead"""
+    return {'created': lead.get('created'), 'id': lead.get('id')}
+
+def is_after_cursor(lead, cursor):
+    """Check whether a lead was created after the cursor position"""
+    if not cursor:
+        return True
+    created = parse_fub_timestamp(lead.get('created'))
+    cursor_created = parse_fub_timestamp(cursor.get('created'))
+    if created is None or cursor_created is None:
+        return True  # Can't tell, so process it
+    if created != cursor_created:
+        return created > cursor_created
+    return (lead.get('id') or 0) > (cursor.get('id') or 0)
+
+def cursor_before(lead):
+    """Cursor that the given lead is just after, so a run from it includes the lead"""
+    return {'created': lead.get('created'), 'id': (lead.get('id') or 0) - 1}
+
+def retry_cursor(new_cursor, unresolved, now=None):
+    """Hold new_cursor back to just before the oldest recent unresolved lead
+    
+    unresolved are cursors of leads that weren't tagged (no city found yet,
+    or a failed read or write). Those created within UNRESOLVED_RETRY_DAYS
+    are retried by the next incremental run; older ones are given up on so
+    a lead that will never have a city doesn't pin the cursor.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    retry_after = now - timedelta(days=UNRESOLVED_RETRY_DAYS)
+    cursor = new_cursor
+    for lead in unresolved:
+        created = parse_fub_timestamp(lead.get('created'))
+        if created is None or created < retry_after:
+            continue
+        before = cursor_before(lead)
+        if cursor is None or is_after_cursor(cursor, before):
+            cursor = before
+    return cursor
+
+def iter_zillow_lead_pages(api_key, since=None):
+    """Yield pages of leads from Follow Up Boss with source 'Zillow'
+    
+    When since is a cursor from get_lead_cursor, only leads created after
+    it are yielded. Pages are then sorted newest first so paging stops
+    at the cursor instead of walking the whole account.
+    """
+    client = get_client(api_key)
+    if not client:
+        print("Failed to create client - invalid API key")
+        return
     
-    all_leads = []
-    offset = 0
-    limit = 100  # Max limit per request
+    # Leads are tagged while paging, so sort on created, which tagging never
+    # changes, to keep the offsets stable
+    params = {'source': 'Zillow', 'sort': '-created' if since else 'created'}
     
-    while True:
-        params = {
-            'source': 'Zillow',
-            'limit': limit,
-            'offset': offset
-        }
+    total = 0
+    for leads in client.iter_pages("/people", 'people', params=params):
+        if since:
+            new_leads = [lead for lead in leads if is_after_cursor(lead, since)]
+        else:
+            new_leads = leads
         
-        response = requests.get(endpoint, headers=headers, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            leads = data.get('people', [])
-            
-            if not leads:  # No more leads to fetch
-                break
-                
-            all_leads.extend(leads)
-            print(f"Fetched {len(leads)} leads (total so far: {len(all_leads)})")
-            
-            # Check if we've reached the end
-            if len(leads) < limit:
+        total += len(new_leads)
+        print(f"Fetched {len(new_leads)} leads (total so far: {total})")
+        if new_leads:
+            yield new_leads
+        
+        # Everything past the cursor was handled by an earlier run
+        if len(new_leads) < len(leads):
+            return
+
+class EventsIndex:
+    """Zillow events grouped by person, from one sweep of the events feed
+    
+    Only the fields the extractor reads are kept. Leads created before
+    the window start may have older events than the sweep saw, so they
+    are not covered and still get their own events request.
+    """
+    
+    def __init__(self, window_start):
+        self.window_start = window_start
+        self.events = {}
+        self.event_count = 0
+    
+    def add(self, event):
+        person_id = event.get('personId')
+        if person_id is None:
+            return
+        self.events.setdefault(str(person_id), []).append({
+            'property': event.get('property') or {},
+            'message': event.get('message') or ''
+        })
+        self.event_count += 1
+    
+    def covers(self, lead):
+        created = parse_fub_timestamp(lead.get('created'))
+        return created is not None and created >= self.window_start
+    
+    def get(self, lead_id):
+        """Events for a lead, newest first (empty if it has none in the window)"""
+        return self.events.get(str(lead_id), [])
+
+def is_zillow_event(event):
+    return 'zillow' in (event.get('source') or '').lower()
+
+def load_events_index(api_key, window_start):
+    """Page through the events feed newest first back to window_start"""
+    client = get_client(api_key)
+    if not client:
+        print("Failed to create client - invalid API key")
+        return None
+    
+    index = EventsIndex(window_start)
+    pages = 0
+    for events in client.iter_pages("/events", 'events', params={'sort': '-created'}):
+        pages += 1
+        reached_start = False
+        for event in events:
+            created = parse_fub_timestamp(event.get('created'))
+            if created is not None and created < window_start:
+                reached_start = True
                 break
-                
-            offset += limit
-        else:
-            print(f"Error getting leads: {response.status_code}")
-            print(f"Response: {response.text}")
+            if is_zillow_event(event):
+                index.add(event)
+        if reached_start:
             break
     
+    print(f"Indexed {index.event_count} Zillow events for {len(index.events)} leads from {pages} event pages")
+    return index
+
+def iter_zillow_leads(api_key, since=None):
+    """Yield Zillow leads one at a time as their pages arrive"""
+    for page in iter_zillow_lead_pages(api_key, since=since):
+        yield from page
+
+def prefetch_pages(pages, depth=DEFAULT_PREFETCH_PAGES):
+    """Fetch up to depth pages ahead of the consumer on a background thread
+    
+    The bounded queue provides backpressure: when the consumer falls behind,
+    the fetch thread blocks instead of buffering the whole account. Errors
+    from the page iterator are re-raised in the consumer.
+    """
+    if depth <= 0:
+        yield from pages
+        return
+    
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+    
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def fetch():
+        try:
+            for page in pages:
+                if not put(page):
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+    
+    thread = threading.Thread(target=fetch, name='page-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Unblock the fetch thread if the consumer stopped early
+        stop.set()
+        thread.join()
+
+def get_zillow_leads(api_key, since=None):
+    """Get all leads from Follow Up Boss with source 'Zillow'"""
+    all_leads = list(iter_zillow_leads(api_key, since=since))
     print(f"Total Zillow leads found: {len(all_leads)}")
     return all_leads
 
-def extract_city_from_address(address_data):
+def extract_city_from_address(address_data, gazetteer=None):
     """Extract and validate city from address data"""
     if not address_data:
         return None
         
-    # If we have a direct city field, use it
-    if 'city' in address_data:
-        city = address_data['city'].strip().title()
-        print(f"Found city in address data: {city}")
-        return city
+    # If we have a direct city field, use its canonical form
+    if address_data.get('city'):
+        city = normalize_city(address_data['city'], gazetteer)
+        if city:
+            print(f"Found city in address data: {city}")
+            return city
         
     # If we have a full address, try to extract city
     if 'full_address' in address_data:
-        full_address = address_data['full_address'].lower()
-        city_pattern = r'(?:greeley|fort morgan|wiggins|woodland park|cheyenne)'
-        city_match = re.search(city_pattern, full_address)
-        if city_match:
-            city = city_match.group(0).title()
+        city = find_city(address_data['full_address'], gazetteer)
+        if city:
             print(f"Extracted city from full address: {city}")
             return city
+        city = get_zip_resolver().resolve_text(address_data['full_address'])
+        if city:
+            print(f"Resolved city from ZIP in full address: {city}")
+            return city
+    
+    # Fall back to the ZIP code
+    if address_data.get('code'):
+        city = get_zip_resolver().resolve(address_data['code'])
+        if city:
+            print(f"Resolved city from ZIP {address_data['code']}: {city}")
+            return city
             
     return None
 
-def update_lead_tags(lead_id, city, api_key):
-    """Update lead tags in Follow Up Boss"""
-    print(f"\nUpdating tags for lead {lead_id} with city {city}")
-    headers = get_headers(api_key)
-    if not headers:
-        print("Failed to create headers - invalid API key")
-        return False
+def build_address(property_data):
+    """Address dict from a property object, or None without a city or known ZIP"""
+    city = property_data.get('city')
+    code = property_data.get('code', '')
+    if not city and code:
+        # Deterministic offline fallback when only the ZIP is present
+        city = get_zip_resolver().resolve(code)
+    if not city:
+        return None
+    return {
+        'street': property_data.get('street', ''),
+        'city': city,
+        'state': property_data.get('state', ''),
+        'code': code
+    }
+
+def get_tag_list(tags):
+    """Normalize a tags value from Follow Up Boss into a list"""
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        return [tag.strip() for tag in tags.split(',') if tag.strip()]
+    return list(tags)
+
+def has_zillow_city_tag(tags):
+    """Check whether a lead's tags already include a Zillow City tag"""
+    return any(tag.startswith("Zillow City:") for tag in get_tag_list(tags))
+
+def get_person(lead_id, api_key):
+    """Get a person record from Follow Up Boss, served from the response cache when fresh"""
+    resource = f"people/{lead_id}"
+    person = response_cache.get(api_key, resource)
+    if person is not None:
+        return person
     
-    endpoint = f"https://api.followupboss.com/v1/people/{lead_id}"
+    client = get_client(api_key)
+    if not client:
+        print("Failed to create client - invalid API key")
+        return None
     
-    # Get current tags
-    response = requests.get(endpoint, headers=headers)
+    response = client.get(f"/people/{lead_id}")
     if response.status_code != 200:
-        print(f"Error getting lead: {response.status_code}")
+        print(f"Error getting lead data: {response.status_code}")
         print(f"Response: {response.text}")
+        return None
+    
+    person = response.json()
+    response_cache.set(api_key, resource, person)
+    return person
+
+def get_recent_events(lead_id, api_key, limit=None):
+    """Get a lead's newest events, served from the response cache when fresh
+    
+    Returns None if the request fails.
+    """
+    if limit is None:
+        limit = FIRST_EVENTS_PAGE
+    resource = f"events?personId={lead_id}&limit={limit}"
+    events = response_cache.get(api_key, resource)
+    if events is not None:
+        return events
+    
+    client = get_client(api_key)
+    if not client:
+        print("Failed to create client - invalid API key")
+        return None
+    
+    params = {
+        'personId': lead_id,
+        'sort': '-created',
+        'limit': limit
+    }
+    response = client.get("/events", params=params)
+    if response.status_code != 200:
+        print(f"Error getting events for lead {lead_id}: {response.status_code}")
+        return None
+    
+    events = response.json().get('events', [])
+    response_cache.set(api_key, resource, events)
+    return events
+
+def update_lead_tags(lead_id, city, api_key, current_tags=None):
+    """Update lead tags in Follow Up Boss
+    
+    Pass current_tags when the person record was already fetched to skip
+    the extra GET before the PUT.
+    """
+    print(f"\nUpdating tags for lead {lead_id} with city {city}")
+    client = get_client(api_key)
+    if not client:
+        print("Failed to create client - invalid API key")
         return False
-        
-    lead_data = response.json()
-    current_tags = lead_data.get('tags', [])
+    
+    endpoint = f"/people/{lead_id}"
+    
+    # Get current tags
+    if current_tags is None:
+        lead_data = get_person(lead_id, api_key)
+        if not lead_data:
+            return False
+        current_tags = lead_data.get('tags', [])
+    current_tags = get_tag_list(current_tags)
     
     # Create new tag
     zillow_city_tag = f"Zillow City: {city}"
     
     # Check if Zillow city tag already exists
-    if any(tag.startswith("Zillow City:") for tag in current_tags):
+    if has_zillow_city_tag(current_tags):
         print("Lead already has a Zillow City tag")
         return True  # Count this as a success since the lead is properly tagged
         
@@ -190,7 +452,10 @@ def update_lead_tags(lead_id, city, api_key):
     
     # Update lead
     update_data = {'tags': new_tags}
-    response = requests.put(endpoint, headers=headers, json=update_data)
+    response = client.put(endpoint, json=update_data)
+    
+    # Whatever the outcome, the cached person may no longer match Follow Up Boss
+    response_cache.invalidate(api_key, f"people/{lead_id}")
     
     if response.status_code == 200:
         print(f"Successfully updated lead {lead_id} with Zillow City tag")
@@ -200,156 +465,239 @@ def update_lead_tags(lead_id, city, api_key):
         print(f"Response: {response.text}")
         return False
 
-def get_property_from_lead(lead_id, api_key):
-    """Get property information from events and lead data"""
-    print(f"\nGetting events for lead {lead_id}")
-    headers = get_headers(api_key)
-    if not headers:
-        print("Failed to create headers - invalid API key")
-        return None
+def queue_zillow_city_tag(tag_writer, lead_id, city, on_done=None):
+    """Queue a Zillow City tag on a TagWriter; the outcome's context is the city"""
+    zillow_city_tag = f"Zillow City: {city}"
     
-    # Define patterns for property inquiry formats
-    property_patterns = [
-        r'interested in\s+([^\.]+)',
-        r'property inquiry:?\s+([^\.]+)',
-        r'viewed\s+([^\.]+)',
-        r'looking at\s+([^\.]+)',
-        r'inquired about\s+([^\.]+)',
-        r'property:\s+([^\.]+)',
-        r'address:\s+([^\.]+)',
-        r'interested in seeing\s+([^\.]+)'
-    ]
-    
-    # Define city pattern
-    city_pattern = r'(?:greeley|fort morgan|wiggins|woodland park|cheyenne)'
-    
-    # Get the lead data to check source data and notes
-    lead_endpoint = f"https://api.followupboss.com/v1/people/{lead_id}"
-    lead_response = requests.get(lead_endpoint, headers=headers)
-    if lead_response.status_code != 200:
-        print(f"Error getting lead data: {lead_response.status_code}")
-        print(f"Response: {lead_response.text}")
-        return None
-        
-    lead_data = lead_response.json()
-    print(f"Got lead data: {json.dumps(lead_data, indent=2)}")
-    
-    # Check source data
-    source_data = lead_data.get('sourceData', {})
-    if source_data:
-        print(f"Checking source data: {str(source_data)[:200]}...")
-        if 'property' in source_data:
-            property_data = source_data['property']
-            city = property_data.get('city')
-            if city:
-                address = {
-                    'street': property_data.get('street', ''),
-                    'city': city,
-                    'state': property_data.get('state', ''),
-                    'code': property_data.get('code', '')
-                }
-                print(f"Found property in source data: {address}")
-                return address
+    def add_city_tag(tags):
+        if has_zillow_city_tag(tags):
+            return tags
+        return tags + [zillow_city_tag]
     
-    # Check notes
-    notes = lead_data.get('notes', [])
-    if notes:
-        for note in notes:
-            message = note.get('message', '')
-            print(f"Checking note: {message[:200]}...")
-            
-            # Check for various property inquiry formats
-            for pattern in property_patterns:
-                address_match = re.search(pattern, message, re.IGNORECASE)
-                if address_match:
-                    address = address_match.group(1).strip()
-                    print(f"Found address using pattern '{pattern}' in note: {address}")
-                    return {'full_address': address}
-            
-            # Look for city names directly
-            city_match = re.search(city_pattern, message.lower())
-            if city_match:
-                city = city_match.group(0).title()
-                print(f"Found city directly in note: {city}")
-                return {'city': city}
-    
-    # Get events for the lead
-    events_endpoint = "https://api.followupboss.com/v1/events"
-    params = {
-        'personId': lead_id,
-        'limit': 100  # Get all recent events
-    }
+    tag_writer.mutate(lead_id, add_city_tag, context=city, on_done=on_done)
+
+def find_property_in_record(record, gazetteer=None):
+    """Property address from a person record's source data or notes"""
+    source_data = record.get('sourceData') or {}
+    if source_data.get('property'):
+        address = build_address(source_data['property'])
+        if address:
+            print(f"Found property in source data: {address}")
+            return address
     
-    events_response = requests.get(events_endpoint, headers=headers, params=params)
-    if events_response.status_code == 200:
-        events_data = events_response.json()
-        events = events_data.get('events', [])
+    for note in record.get('notes') or []:
+        message = note.get('message', '')
+        print(f"Checking note: {message[:200]}...")
         
-        for event in events:
-            # Print first 200 chars of event for debugging
-            print(f"Processing event: {str(event)[:200]}...")
-            
-            # Check for property information in the event
-            property_data = event.get('property', {})
-            if property_data:
-                city = property_data.get('city')
-                if city:
-                    address = {
-                        'street': property_data.get('street', ''),
-                        'city': city,
-                        'state': property_data.get('state', ''),
-                        'code': property_data.get('code', '')
-                    }
-                    print(f"Found property in event: {address}")
-                    return address
+        # Check for property inquiry formats and city names in one scan
+        found = scan_message(message, gazetteer)
+        if found:
+            print(f"Found property in note: {found}")
+            return found
+    
+    return None
+
+def find_property_in_events(events, gazetteer=None):
+    """Property address from a list of events"""
+    for event in events:
+        # Check for property information in the event
+        property_data = event.get('property', {})
+        if property_data:
+            address = build_address(property_data)
+            if address:
+                print(f"Found property in event: {address}")
+                return address
+        
+        # If no property object, check the message
+        message = event.get('message', '')
+        if message:
+            print(f"Checking message: {message[:200]}...")
             
-            # If no property object, check the message
-            message = event.get('message', '')
-            if message:
-                print(f"Checking message: {message[:200]}...")
-                
-                # Check for various property inquiry formats
-                for pattern in property_patterns:
-                    address_match = re.search(pattern, message, re.IGNORECASE)
-                    if address_match:
-                        address = address_match.group(1).strip()
-                        print(f"Found address using pattern '{pattern}' in event: {address}")
-                        return {'full_address': address}
-                
-                # Look for city names directly
-                city_match = re.search(city_pattern, message.lower())
-                if city_match:
-                    city = city_match.group(0).title()
-                    print(f"Found city directly in event: {city}")
-                    return {'city': city}
+            # Check for property inquiry formats and city names in one scan
+            found = scan_message(message, gazetteer)
+            if found:
+                print(f"Found property in event: {found}")
+                return found
     
     return None
 
-def process_lead(lead_id, api_key):
-    """Process a single lead"""
-    print(f"\nProcessing lead {lead_id}")
+def get_property_from_lead(lead_id, api_key, lead_data=None, gazetteer=None, list_lead=None, events=None):
+    """Get property information from lead data and events
+    
+    Sources are tried cheapest first and the first hit wins:
+    list_lead (a people list record, no request), events (from an
+    EventsIndex, no request), the person's source data and notes
+    (lead_data if already fetched, else one GET), the newest
+    FIRST_EVENTS_PAGE events, then older events up to MAX_EVENTS_SCANNED.
+    When events is given it replaces the events requests. The stage that
+    found the property is stored in 'source_stage'. gazetteer selects the
+    market's city names.
+    """
+    print(f"\nGetting property for lead {lead_id}")
+    client = get_client(api_key)
+    if not client:
+        print("Failed to create client - invalid API key")
+        return None
     
-    # Try to get property information from events
-    address_data = get_property_from_lead(lead_id, api_key)
+    address = None
+    stage = 'none'
     
-    if address_data:
-        city = extract_city_from_address(address_data)
-        if city:
-            return update_lead_tags(lead_id, city, api_key)
+    # Stage 1: the list record already in hand
+    if list_lead is not None:
+        address = find_property_in_record(list_lead, gazetteer)
+        if address:
+            stage = 'list'
+    
+    # Stage 2: events from a bulk sweep, no request
+    if not address and events is not None:
+        address = find_property_in_events(events, gazetteer)
+        if address:
+            stage = 'bulk_events'
+    
+    # Stage 3: the full person record, skipped if the list record already had its fields
+    if not address:
+        if lead_data is None and not (list_lead and 'sourceData' in list_lead and 'notes' in list_lead):
+            lead_data = get_person(lead_id, api_key)
+            if not lead_data:
+                return None
+        if lead_data is not None:
+            address = find_property_in_record(lead_data, gazetteer)
+            if address:
+                stage = 'person'
+    
+    # Stage 4: a small page of the newest events, unless the bulk sweep already covered them
+    if not address and events is None:
+        events = get_recent_events(lead_id, api_key)
+        if events is not None:
+            address = find_property_in_events(events, gazetteer)
+            if address:
+                stage = 'events'
+            
+            # Stage 5: older events, only when the first page was full
+            elif len(events) >= FIRST_EVENTS_PAGE and MAX_EVENTS_SCANNED > FIRST_EVENTS_PAGE:
+                scanned = len(events)
+                try:
+                    for events in client.iter_pages("/events", 'events', params={'personId': lead_id, 'sort': '-created'},
+                                                    limit=min(100, MAX_EVENTS_SCANNED - FIRST_EVENTS_PAGE), offset=scanned):
+                        address = find_property_in_events(events, gazetteer)
+                        scanned += len(events)
+                        if address:
+                            stage = 'events_deep'
+                            break
+                        if scanned >= MAX_EVENTS_SCANNED:
+                            break
+                except FollowUpBossError as e:
+                    print(f"Error paging events for lead {lead_id}: {str(e)}")
+    
+    if address:
+        address['source_stage'] = stage
+        print(f"Property for lead {lead_id} found at stage '{stage}'")
+    return address
+
+def run_tag_lead(lead_id, api_key, lead_data=None, gazetteer=None, events_index=None, tag_writer=None):
+    """Tag a lead, joining any run already in flight for the same lead
+    
+    Runs are keyed by the Follow Up Boss account and lead id, so a webhook
+    and a backfill racing on one lead make one set of API calls and one
+    PUT, and both get its result. Returns (status, city, stage) where
+    status is 'tagged', 'queued' (on tag_writer), 'already_tagged',
+    'not_found' or 'failed', and stage is the extraction stage that found
+    the property ('none' if none did, None if extraction never ran). A
+    queued tag keeps the run in flight until it is written, so callers
+    that join it get 'tagged' or 'failed', never 'queued'.
+    """
+    key = (hash_api_key(api_key), str(lead_id))
+    call, leader = lead_flights.begin(key)
+    if not leader:
+        result = lead_flights.wait(call)
+        print(f"Lead {lead_id} was already being tagged - shared its result: {result}")
+        return result
+    
+    def write_done(outcome, stage):
+        lead_flights.finish(key, call, ('tagged' if outcome['ok'] else 'failed', outcome['context'], stage))
+    
+    try:
+        status, city, stage = _tag_lead(lead_id, api_key, lead_data, gazetteer, events_index, tag_writer, write_done)
+    except BaseException as e:
+        lead_flights.finish(key, call, error=e)
+        raise
+    
+    if status != 'queued':
+        lead_flights.finish(key, call, (status, city, stage))
+        return status, city, stage
+    
+    # Anyone waiting is waiting on the write, so start it rather than wait for a full batch
+    call.on_wait = tag_writer.flush
+    if lead_flights.has_waiters(call):
+        tag_writer.flush()
+    return status, city, stage
+
+def _tag_lead(lead_id, api_key, lead_data, gazetteer, events_index, tag_writer, on_written=None):
+    list_lead = None
+    if lead_data is not None and 'tags' in lead_data:
+        list_lead = lead_data
+    else:
+        lead_data = get_person(lead_id, api_key)
+        if not lead_data:
+            return 'failed', None, None
+    
+    if has_zillow_city_tag(lead_data.get('tags')):
+        print(f"Lead {lead_id} already has a Zillow City tag - skipping")
+        return 'already_tagged', None, None
+    
+    events = None
+    if events_index is not None and events_index.covers(lead_data):
+        events = events_index.get(lead_id)
+    
+    # Try the cheapest sources first; the person is only fetched if the list record falls short
+    if list_lead is not None:
+        address_data = get_property_from_lead(lead_id, api_key, gazetteer=gazetteer, list_lead=list_lead, events=events)
     else:
-        print("No property inquiry found for this lead")
+        address_data = get_property_from_lead(lead_id, api_key, lead_data=lead_data, gazetteer=gazetteer, events=events)
     
-    return False
+    stage = address_data['source_stage'] if address_data else 'none'
+    city = extract_city_from_address(address_data, gazetteer) if address_data else None
+    if not city:
+        return 'not_found', None, stage
+    if tag_writer is not None:
+        on_done = None
+        if on_written is not None:
+            on_done = lambda outcome: on_written(outcome, stage)
+        queue_zillow_city_tag(tag_writer, lead_id, city, on_done=on_done)
+        return 'queued', city, stage
+    if not update_lead_tags(lead_id, city, api_key, current_tags=lead_data.get('tags', [])):
+        return 'failed', city, stage
+    return 'tagged', city, stage
 
-def process_all_leads(api_key, subscription_id=None):
-    """Process all Zillow leads for a subscriber"""
+def process_all_leads(api_key, subscription_id=None, concurrency=None, incremental=False, prefetch_depth=None, market=None,
+                      bulk_events=None):
+    """Process all Zillow leads for a subscriber
+    
+    With incremental=True only leads created since the subscription's last
+    successful run are fetched; otherwise the whole account is re-scanned.
+    Either way a successful run moves the subscription's cursor forward,
+    but not past recent leads that couldn't be tagged (see retry_cursor).
+    market (the subscription's market) picks the gazetteer of city names
+    to match against. With bulk_events the events feed is swept once up
+    front instead of fetching events per lead.
+    """
     print("Starting Zillow lead tagging process...")
     
+    if concurrency is None:
+        concurrency = DEFAULT_CONCURRENCY
+    concurrency = max(1, int(concurrency))
+    if prefetch_depth is None:
+        prefetch_depth = DEFAULT_PREFETCH_PAGES
+    if bulk_events is None:
+        bulk_events = DEFAULT_BULK_EVENTS
+    gazetteer = get_gazetteer(market)
+    
     execution_id = None
     
     # If subscription_id is provided, create execution record
     if subscription_id:
         from src.models.database import Database
+        from src.services.execution_recorder import add_to_rollups, rollup_delta, city_count_rows, save_city_counts
         execution_result = Database.create_script_execution(
             subscription_id=subscription_id,
             status='running'
@@ -369,45 +717,134 @@ def process_all_leads(api_key, subscription_id=None):
                     status='failed',
                     error_message='Failed to set up webhook'
                 )
+                add_to_rollups([rollup_delta({'subscription_id': subscription_id, 'status': 'failed'})])
                 return 0
         
-        # Get all Zillow leads
-        leads = get_zillow_leads(api_key)
-        print(f"\nProcessing {len(leads)} Zillow leads")
+        # Get all Zillow leads, or only the new ones since the last run
+        cursor = None
+        if incremental and subscription_id:
+            cursor = Database.get_leads_cursor(subscription_id)
+            print(f"Incremental run since cursor: {cursor}")
+        
+        # Sweep the events feed back to the cursor, or a fixed window for a full run
+        events_index = None
+        if bulk_events:
+            window_start = parse_fub_timestamp(cursor.get('created')) if cursor else None
+            if window_start is None:
+                window_start = datetime.now(timezone.utc) - timedelta(days=BULK_EVENTS_WINDOW_DAYS)
+            events_index = load_events_index(api_key, window_start)
         
+        leads_seen = 0
+        skipped_count = 0
         tagged_count = 0
+        failed_writes = []
         tagged_cities = {}  # Dictionary to track cities and counts
+        new_cursor = cursor  # Newest lead seen becomes the next run's high-water mark
+        unresolved = []  # Cursors of leads that weren't tagged, so they can be retried
+        queued_cursors = {}  # lead id -> cursor for leads whose tag is queued on the writer
+        stage_summary = dict.fromkeys(EXTRACTION_STAGES + ['none'], 0)  # Leads each extraction stage resolved in this run
+        
+        print(f"Processing Zillow leads with concurrency {concurrency}")
+        
+        # Leads are tagged while later pages are still being fetched, and tag
+        # PUTs are written behind extraction. Capping in-flight work keeps
+        # memory at about one page no matter how many leads the account has.
+        max_in_flight = concurrency * 2
+        in_flight = {}  # future -> lead cursor
         
-        for lead in leads:
-            lead_id = lead.get('id')
-            # Get property information
-            address_data = get_property_from_lead(lead_id, api_key)
-            if address_data:
-                city = extract_city_from_address(address_data)
-                if city:
-                    if update_lead_tags(lead_id, city, api_key):
-                        tagged_count += 1
-                        # Track cities
-                        if city in tagged_cities:
-                            tagged_cities[city] += 1
-                        else:
-                            tagged_cities[city] = 1
+        def collect(future):
+            lead_cursor = in_flight.pop(future)
+            status, city, stage = future.result()
+            if stage is not None:
+                stage_summary[stage] += 1
+            if status in ('not_found', 'failed'):
+                unresolved.append(lead_cursor)
+            elif status == 'queued':
+                queued_cursors[lead_cursor['id']] = lead_cursor
         
-        print(f"\nSuccessfully tagged {tagged_count} leads with city information")
+        pages = prefetch_pages(iter_zillow_lead_pages(api_key, since=cursor), prefetch_depth)
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='lead-tagger')
+        from src.services.tag_writer import TagWriter  # tag_writer imports this module
+        tag_writer = TagWriter(api_key)
+        try:
+            for page in pages:
+                leads_seen += len(page)
+                for lead in page:
+                    if is_after_cursor(lead, new_cursor):
+                        new_cursor = get_lead_cursor(lead)
+                    
+                    # Drop leads the list page already shows as tagged before any per-lead calls
+                    if has_zillow_city_tag(lead.get('tags')):
+                        skipped_count += 1
+                        continue
+                    
+                    if len(in_flight) >= max_in_flight:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future)
+                    future = executor.submit(run_tag_lead, lead.get('id'), api_key, lead, gazetteer, events_index, tag_writer)
+                    in_flight[future] = get_lead_cursor(lead)
+            
+            for future in wait(in_flight).done:
+                collect(future)
+        finally:
+            pages.close()
+            executor.shutdown(wait=True, cancel_futures=True)
+            # Write whatever was queued, even if the run is failing
+            outcomes = tag_writer.close()
+        
+        # Count the leads whose tag was actually written; 'unchanged' means someone else tagged it first
+        for lead_id, outcome in outcomes.items():
+            city = outcome['context']
+            if not outcome['ok']:
+                failed_writes.append(lead_id)
+                if lead_id in queued_cursors:
+                    unresolved.append(queued_cursors[lead_id])
+            elif city and outcome['status'] == 'written':
+                tagged_count += 1
+                tagged_cities[city] = tagged_cities.get(city, 0) + 1
+        
+        print(f"\nProcessed {leads_seen} Zillow leads, skipped {skipped_count} already-tagged leads")
+        print(f"Successfully tagged {tagged_count} leads with city information")
+        if failed_writes:
+            print(f"Failed to write tags for {len(failed_writes)} leads: {failed_writes[:20]}")
         print(f"Cities tagged: {tagged_cities}")
+        print(f"Properties found by stage: {stage_summary}")
         
         # Format cities for database
         city_summary = ", ".join([f"{city} ({count})" for city, count in tagged_cities.items()])
         
         # Update execution record
         if execution_id:
+            error_message = None
+            if failed_writes:
+                shown = ", ".join(str(lead_id) for lead_id in failed_writes[:20])
+                error_message = f"Failed to write tags for {len(failed_writes)} leads: {shown}"
             Database.update_script_execution(
                 execution_id=execution_id,
                 status='completed',
-                leads_processed=len(leads),
+                leads_processed=leads_seen,
+                leads_skipped=skipped_count,
                 cities_tagged=tagged_count,
-                tagged_cities=city_summary if tagged_cities else None
+                tagged_cities=city_summary if tagged_cities else None,
+                tag_writes_failed=len(failed_writes),
+                error_message=error_message
             )
+            save_city_counts(city_count_rows(execution_id, subscription_id, tagged_cities))
+            add_to_rollups([rollup_delta({
+                'subscription_id': subscription_id,
+                'status': 'completed',
+                'leads_processed': leads_seen,
+                'leads_skipped': skipped_count,
+                'cities_tagged': tagged_count
+            }, tagged_cities)])
+        
+        # Leads that couldn't be tagged yet (e.g. Zillow's inquiry hadn't landed) are retried next run
+        new_cursor = retry_cursor(new_cursor, unresolved)
+        if unresolved:
+            print(f"{len(unresolved)} leads not tagged; next incremental run starts from {new_cursor}")
+        if subscription_id and new_cursor and new_cursor != cursor:
+            Database.update_leads_cursor(subscription_id, new_cursor)
             
         return tagged_count
     except Exception as e:
@@ -420,6 +857,7 @@ def process_all_leads(api_key, subscription_id=None):
                 status='failed',
                 error_message=str(e)
             )
+            add_to_rollups([rollup_delta({'subscription_id': subscription_id, 'status': 'failed'})])
             
         raise
 
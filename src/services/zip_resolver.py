@@ -0,0 +1,97 @@
+import csv
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left
+
+# Local ZIP table with zip,city,state columns
+ZIP_TABLE_PATH = os.getenv(
+    'ZIP_CITY_TABLE',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'config', 'zip_cities.csv')
+)
+
+ZIP_IN_TEXT = re.compile(r'\b(\d{5})(?:-\d{4})?\b')
+
+class ZipResolver:
+    """ZIP code to city lookup over a compact sorted array
+
+    ZIPs are stored as a sorted array of unsigned ints with a parallel
+    array of indexes into a list of city names, so ~40k US ZIPs take a few
+    hundred KB and a lookup is one binary search.
+    """
+
+    def __init__(self, rows):
+        entries = {}
+        for row in rows:
+            code = parse_zip(row.get('zip'))
+            city = (row.get('city') or '').strip()
+            if code is not None and city:
+                entries[code] = city
+
+        self.cities = []
+        city_indexes = {}
+        self.zips = array('I')
+        self.city_index = array('I')
+        for code in sorted(entries):
+            city = entries[code]
+            if city not in city_indexes:
+                city_indexes[city] = len(self.cities)
+                self.cities.append(city)
+            self.zips.append(code)
+            self.city_index.append(city_indexes[city])
+
+    def __len__(self):
+        return len(self.zips)
+
+    def resolve(self, code):
+        """City for a ZIP code (int or string like '80701-1234'), or None"""
+        if not isinstance(code, int):
+            code = parse_zip(code)
+            if code is None:
+                return None
+        position = bisect_left(self.zips, code)
+        if position < len(self.zips) and self.zips[position] == code:
+            return self.cities[self.city_index[position]]
+        return None
+
+    def resolve_text(self, text):
+        """City for the last ZIP code mentioned in text, or None"""
+        if not text:
+            return None
+        for code in reversed(ZIP_IN_TEXT.findall(text)):
+            city = self.resolve(int(code))
+            if city:
+                return city
+        return None
+
+def parse_zip(value):
+    """First five digits of a ZIP code as an int, or None"""
+    if value is None:
+        return None
+    value = str(value).strip()[:5]
+    if len(value) == 5 and value.isdigit():
+        return int(value)
+    return None
+
+def load_zip_resolver(path=ZIP_TABLE_PATH):
+    """Load the ZIP table from a CSV file"""
+    if not os.path.exists(path):
+        print(f"No ZIP table found at {path} - ZIP fallback disabled")
+        return ZipResolver([])
+    with open(path, newline='', encoding='utf-8') as f:
+        resolver = ZipResolver(csv.DictReader(f))
+    print(f"Loaded {len(resolver)} ZIP codes from {path}")
+    return resolver
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+def get_zip_resolver():
+    """Get the shared ZIP resolver, loading the table once"""
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = load_zip_resolver()
+    return _resolver
@@ -7,6 +7,9 @@ def monitor_service():
     print("Monitoring execution history and service status...")
     print("Press Ctrl+C to stop\n")
     
+    # Latest change_seq seen per subscription; later polls fetch only rows added or changed since
+    cursors = {}
+    
     try:
         while True:
             # Get all active subscriptions
@@ -18,37 +21,42 @@ def monitor_service():
                 print(f"Status: {subscription['status']}")
                 print(f"Follow Up Boss API Key: {'✓ Set' if subscription['followupboss_api_key'] else '✗ Not Set'}")
                 
-                # Get recent executions
-                executions = Database.get_subscription_executions(subscription['id'])
+                # Get the last 5 executions on the first pass, then only new or changed ones
+                cursor = cursors.get(subscription['id'])
+                if cursor is not None:
+                    executions = Database.get_subscription_executions(subscription['id'], since=cursor)
+                else:
+                    cursors[subscription['id']] = Database.get_latest_execution_change(subscription['id'])
+                    executions = Database.get_subscription_executions(subscription['id'], limit=5)
                 if executions.data:
-                    print("\nRecent Executions:")
-                    for execution in executions.data[:5]:  # Show last 5 executions
+                    print("\nNew or Updated Executions:" if cursor is not None else "\nRecent Executions:")
+                    for execution in executions.data:
                         status_symbol = "✓" if execution['status'] == 'completed' else "✗" if execution['status'] == 'failed' else "⋯"
                         created_at = execution['created_at'].split('.')[0].replace('T', ' ')
                         print(f"{status_symbol} [{created_at}] {execution['status'].title()}: {execution['leads_processed']} leads, {execution['cities_tagged']} cities tagged")
                         if execution['error_message']:
                             print(f"   Error: {execution['error_message']}")
+                    if cursor is not None:
+                        cursors[subscription['id']] = Database.latest_change_seq(executions.data, cursor)
                 else:
-                    print("No executions found")
+                    print("No new executions" if cursor is not None else "No executions found")
                 
                 print("-" * 50)
             
-            # Calculate some statistics
+            # Calculate some statistics from the daily rollups
             total_executions = 0
             total_leads = 0
             total_cities = 0
             errors = 0
             
             for subscription in subscriptions.data:
-                executions = Database.get_subscription_executions(subscription['id'])
-                for execution in executions.data:
-                    total_executions += 1
-                    total_leads += execution['leads_processed'] or 0
-                    total_cities += execution['cities_tagged'] or 0
-                    if execution['status'] == 'failed':
-                        errors += 1
+                summary = Database.get_rollup_summary(subscription['id'], days=30)
+                total_executions += summary['executions']
+                total_leads += summary['leads_processed']
+                total_cities += summary['cities_tagged']
+                errors += summary['failed_executions']
             
-            print("\nOverall Statistics:")
+            print("\nOverall Statistics (last 30 days):")
             print(f"Total Executions: {total_executions}")
             print(f"Total Leads Processed: {total_leads}")
             print(f"Total Cities Tagged: {total_cities}")